@@ -0,0 +1,92 @@
+# %%
+import json, time
+import numpy as np
+
+from src.configs import RetrieverConfig
+from src.retriever import NumpyRetriever, QdrantRetriever
+from src.lookup_builder import LookupBuilder
+from src.substitution import get_compared_values
+
+# %%
+db_file = 'data/TREQS/evaluation/mimic_db/mimic.db'
+index_path = 'data/TREQS/evaluation/mimic_db/numpy_lookup'
+
+testset = []
+with open("./data/TREQS/mimicsql_data/mimicsql_natural_v2/test.json", "r") as f:
+    for line in f.readlines():
+        testset.append(json.loads(line))
+
+# Lookup workload: the values compared in the gold queries, i.e. the values lookup has to find
+queries = sorted({value for data in testset for value in get_compared_values(data["sql"])})
+len(queries)
+
+# %%
+# float32 reference, built once; the quantized variants reuse its vectors on disk
+reference = NumpyRetriever("lookup_ehrsql", path=index_path)
+if not reference._payloads:
+    LookupBuilder(reference, db_file).build()
+
+# %%
+def run(retriever, queries, top_k, batch_size=64):
+    results = []
+    start = time.perf_counter()
+    for idx in range(0, len(queries), batch_size):
+        results.extend(retriever.retrieve_many(queries[idx:idx + batch_size], top_k))
+    elapsed = time.perf_counter() - start
+    return [[doc.metadata["_id"] for doc in docs] for docs in results], elapsed / len(queries)
+
+def recall_at_k(results, reference_results):
+    return np.mean([
+        len(set(result) & set(expected)) / len(expected)
+        for result, expected in zip(results, reference_results) if expected
+    ])
+
+# %%
+top_k = 100
+reference_results, reference_latency = run(reference, queries, top_k)
+
+report = [{
+    "quantization": None,
+    "rescore": None,
+    "recall@k": 1.,
+    "ms_per_query": reference_latency * 1000,
+    "ram_mb": np.asarray(reference._vectors).nbytes / 2 ** 20,
+}]
+
+for quantization in ["scalar", "binary"]:
+    for rescore in [True, False]:
+        retriever = NumpyRetriever(
+            "lookup_ehrsql",
+            RetrieverConfig(quantization=quantization, quantization_rescore=rescore),
+            path=index_path,
+        )
+        results, latency = run(retriever, queries, top_k)
+        report.append({
+            "quantization": quantization,
+            "rescore": rescore,
+            "recall@k": recall_at_k(results, reference_results),
+            "ms_per_query": latency * 1000,
+            "ram_mb": (retriever._codes.nbytes + retriever._scales.nbytes) / 2 ** 20,
+        })
+
+report
+
+# %%
+# Same comparison on Qdrant, one collection per configuration
+qdrant_results = {}
+for quantization in [None, "scalar", "binary"]:
+    retriever = QdrantRetriever(
+        collection_name=f"lookup_ehrsql_{quantization or 'float32'}",
+        config=RetrieverConfig(quantization=quantization),
+    )
+    LookupBuilder(retriever, db_file).build()
+    qdrant_results[quantization] = run(retriever, queries, top_k)
+
+{
+    quantization: {
+        "recall@k": recall_at_k(results, qdrant_results[None][0]),
+        "ms_per_query": latency * 1000,
+    } for quantization, (results, latency) in qdrant_results.items()
+}
+
+# %%
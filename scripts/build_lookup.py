@@ -1,6 +1,8 @@
 # %%
 from src.retriever import QdrantRetriever
-from data.TREQS.evaluation.utils import *
+from src.gazetteer import GazetteerExtractor
+from src.lookup_builder import LookupBuilder
+from src.lexical_index import ExactMatchIndex, TrigramIndex
 from langchain_community.utilities.sql_database import SQLDatabase
 
 # %%
@@ -9,38 +11,41 @@ sql_db = SQLDatabase.from_uri(DATABASE_URI)
 
 # %%
 db_file = 'data/TREQS/evaluation/mimic_db/mimic.db'
-model = query(db_file)
-(db_meta, db_tabs, db_head) = model._load_db(db_file)
 
 # %%
 lookup_table = QdrantRetriever(collection_name="lookup_ehrsql")
 
 # %%
-datapoints = []
-ignored_columns = ["TIME", "DOB", "DOD", "CODE", "DRUG_DOSE", "VALUE_UNIT"]
+builder = LookupBuilder(
+    lookup_table,
+    db_file,
+    checkpoint_path="data/TREQS/evaluation/mimic_db/lookup_checkpoint.json",
+)
+builder.build()
 
-for tb in db_meta:
-    for hd in db_meta[tb]:
-        mysql = 'select distinct {} from {}'.format(hd, tb)
-        myres = model.execute_sql(mysql).fetchall()
-        myres = list({k[0]: {} for k in myres if not k[0] == None})
-        db_meta[tb][hd] = myres
-
-        for entity in myres:
-            if isinstance(entity, str):
-                if not any([x in hd for x in ignored_columns]):
-                    datapoints.append({
-                        "entity": entity,
-                        "table": tb,
-                        "column": hd,
-                    })
+# %%
+# Incremental refresh after the database changed: only added/removed values are applied
+builder.sync()
 
-datapoints
+# %%
+lookup_table.retrieve("diphenhydramine", 50)
 
 # %%
-lookup_table.ingest(datapoints, "entity")
+gazetteer = GazetteerExtractor.from_lookup(builder.iter_datapoints())
+gazetteer.save("data/TREQS/evaluation/mimic_db/gazetteer.pkl")
+
+gazetteer.extract("count the number of patients whose ethnicity is white -russian")
 
 # %%
-lookup_table.retrieve("diphenhydramine", 50)
+exact_index = ExactMatchIndex.from_lookup(builder.iter_datapoints())
+exact_index.save("data/TREQS/evaluation/mimic_db/exact_index.pkl")
+
+exact_index.get("White - Russian")
 
 # %%
+trigram_index = TrigramIndex.from_lookup(builder.iter_datapoints())
+trigram_index.save("data/TREQS/evaluation/mimic_db/trigram_index.pkl")
+
+trigram_index.search("diphenhydramin", 10)
+
+# %%
\ No newline at end of file
@@ -0,0 +1,31 @@
+# %%
+from src.configs import RetrieverConfig
+from src.retriever import QdrantRetriever
+
+# %%
+snapshot_dir = "data/snapshots"
+collection_names = ["lookup_ehrsql", "cbr_full"]
+
+# %%
+# Export the collections of the Qdrant server to portable files
+for collection_name in collection_names:
+    QdrantRetriever(collection_name=collection_name).export_snapshot(f"{snapshot_dir}/{collection_name}.npz")
+
+# %%
+# Serve them from an embedded Qdrant: empty collections are filled from the snapshots at startup
+local_config = RetrieverConfig(qdrant_path="data/qdrant_local")
+
+lookup_table = QdrantRetriever(
+    collection_name="lookup_ehrsql",
+    config=local_config,
+    snapshot_path=f"{snapshot_dir}/lookup_ehrsql.npz",
+)
+cbr_retriever = QdrantRetriever(
+    collection_name="cbr_full",
+    config=local_config,
+    snapshot_path=f"{snapshot_dir}/cbr_full.npz",
+)
+
+lookup_table.retrieve("diphenhydramine", 5)
+
+# %%
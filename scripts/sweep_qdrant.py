@@ -0,0 +1,96 @@
+# %%
+import json, time
+import numpy as np
+from dataclasses import replace
+
+from qdrant_client import models
+
+from src.configs import RetrieverConfig
+from src.retriever import QdrantRetriever
+from src.substitution import get_compared_values
+
+# %%
+testset = []
+with open("./data/TREQS/mimicsql_data/mimicsql_natural_v2/test.json", "r") as f:
+    for line in f.readlines():
+        testset.append(json.loads(line))
+
+workloads = {
+    # Lookup: the values compared in the gold queries; case base: the test questions
+    "lookup_ehrsql": sorted({value for data in testset for value in get_compared_values(data["sql"])}),
+    "cbr_full": [data["question_refine"] for data in testset],
+}
+
+# %%
+def copy_collection(source: QdrantRetriever, target: QdrantRetriever, batch_size: int = 1000):
+    """
+    Copy points with their vectors, so a new HNSW configuration does not need re-embedding.
+    """
+    offset = None
+    while True:
+        points, offset = source.client.scroll(
+            collection_name=source.collection_name,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        target.client.upsert(
+            collection_name=target.collection_name,
+            points=[models.PointStruct(id=point.id, vector=point.vector, payload=point.payload) for point in points],
+        )
+        if offset is None:
+            break
+
+def search(retriever: QdrantRetriever, vectors, top_k: int, params: models.SearchParams = None, batch_size: int = 64):
+    results = []
+    start = time.perf_counter()
+    for idx in range(0, len(vectors), batch_size):
+        responses = retriever.client.query_batch_points(
+            collection_name=retriever.collection_name,
+            requests=[
+                models.QueryRequest(query=vector, limit=top_k, params=params)
+                for vector in vectors[idx:idx + batch_size]
+            ],
+        )
+        results.extend([[point.id for point in response.points] for response in responses])
+    return results, (time.perf_counter() - start) / len(vectors)
+
+def recall_at_k(results, reference_results):
+    return np.mean([
+        len(set(result) & set(expected)) / len(expected)
+        for result, expected in zip(results, reference_results) if expected
+    ])
+
+# %%
+top_k = 100
+graph_grid = [(16, 100), (16, 200), (32, 200), (64, 400)]
+ef_grid = [32, 64, 128, 256, 512]
+
+report = []
+for collection_name, queries in workloads.items():
+    source = QdrantRetriever(collection_name=collection_name)
+    vectors = source.embedder.embed_documents(queries)
+    exact_results, exact_latency = search(source, vectors, top_k, models.SearchParams(exact=True))
+
+    for m, ef_construct in graph_grid:
+        config = replace(RetrieverConfig.default(), hnsw_m=m, hnsw_ef_construct=ef_construct)
+        target = QdrantRetriever(collection_name=f"{collection_name}_m{m}_ef{ef_construct}", config=config)
+        if target.client.count(target.collection_name).count == 0:
+            copy_collection(source, target)
+
+        for ef in ef_grid:
+            results, latency = search(target, vectors, top_k, models.SearchParams(hnsw_ef=ef))
+            report.append({
+                "collection": collection_name,
+                "m": m,
+                "ef_construct": ef_construct,
+                "ef": ef,
+                "recall@k": recall_at_k(results, exact_results),
+                "ms_per_query": latency * 1000,
+                "exact_ms_per_query": exact_latency * 1000,
+            })
+
+report
+
+# %%
@@ -12,6 +12,7 @@ from src.rag_pipeline import RAG2SQL, CBR2SQL
 from src.retriever import QdrantRetriever
 from langchain_community.utilities.sql_database import SQLDatabase
 from src.metrics import logic_form_accuracy, execution_accuracy
+from src.cache import SQLExecutionCache
 
 # %%
 def train(rag_pipeline: RAG2SQL, dataset: List[Dict]):
@@ -20,28 +21,22 @@ def train(rag_pipeline: RAG2SQL, dataset: List[Dict]):
         sql_query = data["sql"]
         rag_pipeline.retain(query, sql_query)
 
-def generate_results(rag_pipeline: RAG2SQL, dataset: List[Dict]):
+def generate_results(rag_pipeline: RAG2SQL, dataset: List[Dict], batch_size: int = 64, max_concurrency: int = 8):
     result_dataset = []
 
-    for data in tqdm(dataset, total=len(dataset)):
-        query = data["question_refine"]
-        sql_query = data["sql"]
+    for start in tqdm(range(0, len(dataset), batch_size)):
+        batch = dataset[start:start + batch_size]
+        responses = rag_pipeline.query_batch(
+            [data["question_refine"] for data in batch],
+            max_concurrency=max_concurrency,
+        )
 
-        try:
-            response = rag_pipeline.query(query)
-        except Exception as e:
-            response = {
-                "response": str(e),
-                "sql_query": "",
-                "sql_response": "",
-                "retrieved_cases": "",
-            }
-
-        response.update({
-            "query": query,
-            "golden_sql_query": sql_query,
-        })
-        result_dataset.append(response)
+        for data, response in zip(batch, responses):
+            response.update({
+                "query": data["question_refine"],
+                "golden_sql_query": data["sql"],
+            })
+            result_dataset.append(response)
 
     return result_dataset
 
@@ -118,14 +113,18 @@ logic_form_accuracy(result_dataset_cbr)
 # %%
 logic_form_accuracy(result_dataset_rag)
 
+# %%
+# Gold queries are shared by both evaluations; execute each once
+sql_cache = SQLExecutionCache()
+
 # %%
 # Compute metrics
-ex_score, error_cbr, success_cbr = execution_accuracy(sql_db, result_dataset_cbr)
+ex_score, error_cbr, success_cbr = execution_accuracy(sql_db, result_dataset_cbr, sql_cache)
 print(ex_score)
 
 # %%
 # Compute metrics
-ex_score, error_rag, success_rag = execution_accuracy(sql_db, result_dataset_rag)
+ex_score, error_rag, success_rag = execution_accuracy(sql_db, result_dataset_rag, sql_cache)
 print(ex_score)
 
 # %%
@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import BaseMessage, messages_to_dict, messages_from_dict
+
+from utils import get_data_version
+from substitution import canonicalize_sql
+
+
+class BaseLLMCache:
+    def get(self, key: str) -> Optional[BaseMessage]:
+        raise NotImplementedError()
+
+    def set(self, key: str, message: BaseMessage):
+        raise NotImplementedError()
+
+    def clear(self):
+        raise NotImplementedError()
+
+    def stats(self) -> Dict:
+        raise NotImplementedError()
+
+
+class SQLiteLLMCache(BaseLLMCache):
+    """
+    LLM responses stored in a SQLite file, with LRU eviction beyond `max_entries`
+    and optional expiry after `ttl` seconds.
+    """
+    def __init__(self, path: str, max_entries: int = 10000, ttl: float = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed_at ON llm_cache (accessed_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[BaseMessage]:
+        now = time.time()
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+
+        return messages_from_dict([json.loads(row[0])])[0]
+
+    def set(self, key: str, message: BaseMessage):
+        now = time.time()
+        value = json.dumps(messages_to_dict([message])[0], default=str)
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.,
+            "entries": entries,
+        }
+
+
+class AnswerCache:
+    """
+    In-memory LRU cache of pipeline results, keyed by a normalized question and a signature
+    of the values its entities resolve to. Each entry keeps the database version its rows
+    were read at. With an `embedder` and a `similarity_threshold`, an exact miss falls back
+    to the most similar cached question with the same signature, if close enough.
+    """
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        embedder: Embeddings = None,
+        similarity_threshold: float = None,
+    ):
+        self.max_entries = max_entries
+        self.embedder = embedder
+        self.similarity_threshold = similarity_threshold
+
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @property
+    def similarity_enabled(self) -> bool:
+        return self.embedder is not None and self.similarity_threshold is not None
+
+    def _embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(self.embedder.embed_query(question), dtype=np.float32)
+        return vector / max(np.linalg.norm(vector), 1e-12)
+
+    def get(self, question: str, signature: Tuple) -> Optional[Tuple[Dict, str]]:
+        """
+        The cached entry and the tier that found it ("exact" or "similar"), or None.
+        """
+        with self._lock:
+            entry = self._entries.get((question, signature))
+            if entry is not None:
+                self._entries.move_to_end((question, signature))
+                self.exact_hits += 1
+                return entry, "exact"
+            if not self.similarity_enabled:
+                self.misses += 1
+                return None
+
+        vector = self._embed(question)
+        with self._lock:
+            candidates = [(key, entry) for key, entry in self._entries.items() if key[1] == signature]
+            if candidates:
+                similarities = np.stack([entry["vector"] for _, entry in candidates]) @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    self._entries.move_to_end(candidates[best][0])
+                    self.similar_hits += 1
+                    return candidates[best][1], "similar"
+
+            self.misses += 1
+            return None
+
+    def set(self, question: str, signature: Tuple, result: Dict, db_version):
+        vector = self._embed(question) if self.similarity_enabled else None
+        with self._lock:
+            self._entries[(question, signature)] = {"result": result, "db_version": db_version, "vector": vector}
+            self._entries.move_to_end((question, signature))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.exact_hits = 0
+            self.similar_hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict:
+        requests = self.exact_hits + self.similar_hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.similar_hits) / requests if requests else 0.,
+            "exact_hit_rate": self.exact_hits / requests if requests else 0.,
+            "similar_hit_rate": self.similar_hits / requests if requests else 0.,
+            "entries": len(self._entries),
+        }
+
+
+class SQLExecutionCache:
+    """
+    In-memory LRU of query results keyed by canonical SQL text, bounded by the total size of
+    the cached results (`max_bytes`). Entries are tagged with the data version they
+    were read at and dropped once it changes.
+    """
+    def __init__(self, max_bytes: int = 64 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, sql: str, db_version) -> Optional[str]:
+        key = canonicalize_sql(sql)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] != db_version:
+                self._pop(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, sql: str, db_version, result: str):
+        key = canonicalize_sql(sql)
+        size = len(key) + len(str(result))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (db_version, result, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def _pop(self, key: str):
+        self.size -= self._entries.pop(key)[2]
+
+    def run(self, sql_db, sql: str) -> str:
+        """
+        `sql_db.run(sql)`, served from the cache while the database is unchanged.
+        Errors are raised and not cached, and nothing is cached for databases without
+        a data version.
+        """
+        db_version = get_data_version(sql_db)
+        if db_version is None:
+            return sql_db.run(sql)
+        result = self.get(sql, db_version)
+        if result is None:
+            result = sql_db.run(sql)
+            self.set(sql, db_version, result)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict:
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.,
+            "entries": len(self._entries),
+            "bytes": self.size,
+        }
@@ -13,6 +13,28 @@ class RetrieverConfig:
     embedding_dim: int = 384
     device: str = "cpu"
     embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2"
+    # Storage dtype of the NumpyRetriever matrix ("float32" or "float16")
+    vector_dtype: str = "float32"
+    # On-disk embedding cache shared by ingest and retrieve (disabled when None)
+    embedding_cache_dir: str = None
+    # Bulk ingestion: documents per embedding/upsert batch, concurrent upload threads
+    ingest_batch_size: int = 256
+    ingest_workers: int = 4
+    # Quantized vector storage: None, "scalar" (int8) or "binary"; candidates are
+    # over-sampled by `quantization_oversampling` and rescored on the original vectors
+    quantization: str = None
+    quantization_rescore: bool = True
+    quantization_oversampling: float = 2.0
+    # Qdrant HNSW graph (collection creation) and search-time beam width; None keeps server defaults
+    hnsw_m: int = None
+    hnsw_ef_construct: int = None
+    hnsw_ef: int = None
+    # Qdrant storage: on-disk vectors (None: on disk only when quantized) and payload
+    on_disk_vectors: bool = None
+    on_disk_payload: bool = None
+    prefer_grpc: bool = False
+    # Embedded Qdrant instead of the server: a storage directory, or ":memory:"
+    qdrant_path: str = None
 
     @classmethod
     def default(cls):
@@ -24,6 +46,10 @@ class LLMConfig:
     model: str = "gpt-4o"
     temperature: int = 0.
     top_p: int = None
+    # Response cache (disabled when cache_path is None)
+    cache_path: str = None
+    cache_max_entries: int = 10000
+    cache_ttl: float = None
 
     @classmethod
     def default(cls):
@@ -37,6 +63,40 @@ class RAGConfig:
     return_response: bool = False
     template_construction: bool = True
     source_discovery: bool = True
+    # Only send the tables/columns referenced by retrieved cases and lookup matches
+    schema_pruning: bool = False
+    # Substitute unambiguous lookup matches without an LLM call
+    rule_based_discovery: bool = True
+    substitution_threshold: int = 0
+    # Reuse the top case's SQL as template above this similarity (disabled when None)
+    case_reuse_threshold: float = None
+    # Fall back to LLM masking when the gazetteer finds fewer entities than this or leaves digits unmasked
+    gazetteer_fallback: bool = True
+    gazetteer_min_entities: int = 1
+    # Lookup candidates: "dense" (vector search), "trigram" (TrigramIndex) or "hybrid" (both merged)
+    lookup_engine: str = "dense"
+    lookup_max_distance: int = None
+    # Search only the (table, column) pairs mapped to the entity label
+    label_filtering: bool = False
+    # Answer cache of CBR2SQL (similarity tier disabled when answer_cache_similarity is None)
+    answer_cache: bool = False
+    answer_cache_max_entries: int = 1000
+    answer_cache_similarity: float = None
+    # SQL execution cache, bounded by the size of the cached results
+    sql_cache: bool = False
+    sql_cache_max_bytes: int = 64 * 2 ** 20
+    # Guarded SQL execution: timeout in seconds, row cap and result size cap in bytes (None disables one)
+    guarded_execution: bool = False
+    sql_timeout: float = 30.
+    sql_max_rows: int = 10000
+    sql_memory_limit: int = 256 * 2 ** 20
+    # Planner check before execution: loops without index over tables of plan_check_large_table rows
+    # are flagged, and those of the plan_check_reject kinds sent to the repair step ("llm" or None)
+    plan_check: bool = False
+    plan_check_large_table: int = 100000
+    plan_check_reject: tuple = ("unindexed_join",)
+    plan_repair: str = "llm"
+    plan_repair_attempts: int = 1
 
     @classmethod
     def default(cls):
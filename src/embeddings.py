@@ -0,0 +1,156 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+from typing import List, Dict, Tuple, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_community.embeddings import HuggingFaceEmbeddings
+
+
+_registry: Dict[Tuple[str, str, Optional[str]], "SharedEmbeddings"] = {}
+_registry_lock = threading.Lock()
+
+
+class EmbeddingCache:
+    """
+    Append-only on-disk embedding store for one model, keyed by a hash of the text.
+    `keys.bin` holds 16-byte digests and `vectors.bin` the float32 rows in the same order;
+    the rows are memory-mapped for reads.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._index = {}
+        self._vectors = None
+        self.dim = None
+
+        meta_path = os.path.join(directory, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r") as f:
+                self.dim = json.load(f)["dim"]
+            self._load()
+
+    @property
+    def keys_path(self) -> str:
+        return os.path.join(self.directory, "keys.bin")
+
+    @property
+    def vectors_path(self) -> str:
+        return os.path.join(self.directory, "vectors.bin")
+
+    def _load(self):
+        with open(self.keys_path, "rb") as f:
+            keys = f.read()
+        n_rows = min(len(keys) // 16, os.path.getsize(self.vectors_path) // (4 * self.dim))
+
+        # Drop a partially written tail left by an interrupted append
+        for path, size in [(self.keys_path, n_rows * 16), (self.vectors_path, n_rows * 4 * self.dim)]:
+            if os.path.getsize(path) != size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+
+        self._index = {keys[idx * 16:(idx + 1) * 16]: idx for idx in range(n_rows)}
+        self._map(n_rows)
+
+    def _map(self, n_rows: int):
+        self._vectors = np.memmap(
+            self.vectors_path, dtype=np.float32, mode="r", shape=(n_rows, self.dim),
+        ) if n_rows else None
+
+    @staticmethod
+    def get_key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        with self._lock:
+            rows = [self._index.get(self.get_key(text)) for text in texts]
+            return [None if row is None else np.array(self._vectors[row]) for row in rows]
+
+    def put_many(self, texts: List[str], vectors: List[List[float]]):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(os.path.join(self.directory, "meta.json"), "w") as f:
+                    json.dump({"dim": self.dim}, f)
+                open(self.keys_path, "ab").close()
+                open(self.vectors_path, "ab").close()
+
+            keys, rows = {}, []
+            for text, vector in zip(texts, vectors):
+                key = self.get_key(text)
+                if key not in self._index and key not in keys:
+                    keys[key] = len(self._index) + len(keys)
+                    rows.append(vector)
+            if not keys:
+                return
+
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.stack(rows).tobytes())
+            with open(self.keys_path, "ab") as f:
+                f.write(b"".join(keys))
+
+            # Only the new rows are indexed; the memmap is remapped to the grown file
+            self._index.update(keys)
+            self._map(len(self._index))
+
+
+class SharedEmbeddings(Embeddings):
+    """
+    One HuggingFace embedding model shared by every retriever of the process.
+    The weights are loaded on first use, and calls are serialized with a lock.
+    With `cache_dir`, embeddings are also cached on disk by text, so ingest and
+    retrieve only encode strings this model has never seen.
+    """
+    def __init__(self, model_name: str, device: str, cache_dir: str = None):
+        self.model_name = model_name
+        self.device = device
+
+        self._model = None
+        self._lock = threading.Lock()
+        self.cache = EmbeddingCache(
+            os.path.join(cache_dir, model_name.replace("/", "__")),
+        ) if cache_dir else None
+
+    @property
+    def model(self) -> HuggingFaceEmbeddings:
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = HuggingFaceEmbeddings(
+                        model_name=self.model_name,
+                        model_kwargs={"device": self.device},
+                    )
+        return self._model
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        model = self.model
+        with self._lock:
+            return model.embed_documents(texts)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.cache is None:
+            return self._encode(texts)
+
+        vectors = self.cache.get_many(texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            self.cache.put_many(missing, self._encode(missing))
+            vectors = self.cache.get_many(texts)
+        return [vector.tolist() for vector in vectors]
+
+    def embed_query(self, text: str) -> List[float]:
+        # HuggingFaceEmbeddings encodes queries and documents the same way
+        return self.embed_documents([text])[0]
+
+
+def get_embedder(model_name: str, device: str = "cpu", cache_dir: str = None) -> SharedEmbeddings:
+    key = (model_name, device, cache_dir)
+    with _registry_lock:
+        if key not in _registry:
+            _registry[key] = SharedEmbeddings(model_name, device, cache_dir)
+        return _registry[key]
@@ -0,0 +1,192 @@
+import re
+import pickle
+from collections import deque
+from typing import List, Dict, Iterable, Tuple
+
+from schema import Entity, MaskingResults
+
+
+# Label of the values of a (table, column), from the labels of the masking prompt;
+# values of unlisted columns (admission types, flags, ...) are general words and not masked
+DEFAULT_COLUMN_LABELS = {
+    ("DEMOGRAPHIC", "DIAGNOSIS"): "CONDITION",
+    ("DEMOGRAPHIC", "NAME"): "NAME",
+    ("DEMOGRAPHIC", "ETHNICITY"): "ETHNICITY",
+    ("DEMOGRAPHIC", "RELIGION"): "RELIGION",
+    ("DIAGNOSES", "SHORT_TITLE"): "CONDITION",
+    ("DIAGNOSES", "LONG_TITLE"): "CONDITION",
+    ("PROCEDURES", "SHORT_TITLE"): "PROCEDURE",
+    ("PROCEDURES", "LONG_TITLE"): "PROCEDURE",
+    ("PRESCRIPTIONS", "DRUG"): "DRUG",
+    ("LAB", "LABEL"): "PROCEDURE",
+    ("LAB", "CATEGORY"): "PROCEDURE",
+}
+
+# When a value appears in several columns, the first label in this list wins
+LABEL_PRIORITY = ["CONDITION", "PROCEDURE", "DRUG", "NAME", "ETHNICITY", "RELIGION", "EQUIPMENT"]
+
+DEFAULT_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it",
+    "of", "on", "or", "the", "to", "was", "with", "other", "unknown", "none", "not",
+}
+
+TOKEN_PATTERN = re.compile(r"\b\w+\b")
+# Digits (years, ages, ICD-9 codes, IDs) left after masking: the LLM masking labels these
+# TIME, CODE, MEASUREMENT, ... which the gazetteer cannot reproduce
+UNMASKED_VALUE_PATTERN = re.compile(r"\d")
+
+
+def get_label_sources(column_labels: Dict[Tuple[str, str], str] = DEFAULT_COLUMN_LABELS) -> Dict[str, List[Tuple[str, str]]]:
+    """
+    Invert a column labelling: the (table, column) pairs holding the values of each label.
+    """
+    label_sources = {}
+    for source, label in column_labels.items():
+        label_sources.setdefault(label, []).append(source)
+    return label_sources
+
+
+class GazetteerExtractor:
+    """
+    In-process entity masking over the values of the lookup table.
+
+    Values are matched as whole token sequences with an Aho-Corasick automaton built over
+    their normalized tokens, keeping the leftmost-longest non-overlapping matches. The result
+    has the same `MaskingResults` structure as the LLM masking.
+    """
+    def __init__(self, min_length: int = 3, stopwords: Iterable[str] = DEFAULT_STOPWORDS):
+        self.min_length = min_length
+        self.stopwords = set(stopwords)
+
+        self._goto = [{}]
+        self._fail = [0]
+        self._depth = [0]
+        self._label = [None]
+        self._dict_link = [0]
+        self._built = True
+
+    @classmethod
+    def from_lookup(
+        cls,
+        datapoints: Iterable[Dict],
+        column_labels: Dict[Tuple[str, str], str] = DEFAULT_COLUMN_LABELS,
+        index_field: str = "entity",
+        **kwargs,
+    ) -> "GazetteerExtractor":
+        """
+        Build from lookup datapoints, i.e. dicts with the value, its table and its column.
+        Only the values of the columns in `column_labels` are indexed.
+        """
+        extractor = cls(**kwargs)
+        for datapoint in datapoints:
+            label = column_labels.get((datapoint["table"], datapoint["column"]))
+            if label is not None:
+                extractor.add(datapoint[index_field], label)
+        extractor.build()
+        return extractor
+
+    @classmethod
+    def load(cls, path: str) -> "GazetteerExtractor":
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def save(self, path: str):
+        self.build()
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+
+    def add(self, value: str, label: str):
+        tokens = [token.lower() for token in TOKEN_PATTERN.findall(value)]
+        if not tokens or len(" ".join(tokens)) < self.min_length:
+            return
+        if all(token in self.stopwords for token in tokens):
+            return
+
+        node = 0
+        for token in tokens:
+            if token not in self._goto[node]:
+                self._goto[node][token] = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._depth.append(self._depth[node] + 1)
+                self._label.append(None)
+                self._dict_link.append(0)
+            node = self._goto[node][token]
+
+        self._label[node] = min(
+            [label] if self._label[node] is None else [self._label[node], label],
+            key=lambda x: LABEL_PRIORITY.index(x) if x in LABEL_PRIORITY else len(LABEL_PRIORITY),
+        )
+        self._built = False
+
+    def build(self):
+        """
+        Compute the failure and dictionary-suffix links (breadth-first).
+        """
+        if self._built:
+            return
+
+        queue = deque()
+        for child in self._goto[0].values():
+            self._fail[child] = 0
+            self._dict_link[child] = 0
+            queue.append(child)
+
+        while queue:
+            node = queue.popleft()
+            for token, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and token not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(token, 0)
+
+                self._fail[child] = fail
+                self._dict_link[child] = fail if self._label[fail] is not None else self._dict_link[fail]
+                queue.append(child)
+
+        self._built = True
+
+    def find(self, text: str) -> List[Tuple[int, int, str]]:
+        """
+        Leftmost-longest non-overlapping matches as (start char, end char, label).
+        """
+        self.build()
+        spans = [(match.start(), match.end()) for match in TOKEN_PATTERN.finditer(text)]
+
+        candidates = []
+        node = 0
+        for idx, (start, end) in enumerate(spans):
+            token = text[start:end].lower()
+            while node and token not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(token, 0)
+
+            output = node if self._label[node] is not None else self._dict_link[node]
+            while output:
+                candidates.append((idx - self._depth[output] + 1, idx + 1, self._label[output]))
+                output = self._dict_link[output]
+
+        matches = []
+        last_end = 0
+        for first, last, label in sorted(candidates, key=lambda x: (x[0], -x[1])):
+            if first >= last_end:
+                matches.append((spans[first][0], spans[last - 1][1], label))
+                last_end = last
+        return matches
+
+    @staticmethod
+    def has_unmasked_values(masked_sentence: str) -> bool:
+        return UNMASKED_VALUE_PATTERN.search(masked_sentence) is not None
+
+    def extract(self, text: str) -> MaskingResults:
+        masked_sentence = text
+        entities = []
+
+        for start, end, label in reversed(self.find(text)):
+            entities.append(Entity(value=text[start:end], label=label))
+            masked_sentence = masked_sentence[:start] + label + masked_sentence[end:]
+
+        return MaskingResults(
+            masked_sentence=masked_sentence,
+            redacted_entities=list(reversed(entities)),
+        )
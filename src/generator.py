@@ -1,11 +1,16 @@
 import os
+import json
 import httpx
+import hashlib
+import asyncio
 from typing import List, Tuple
 
 from langchain_openai.chat_models import ChatOpenAI
 from langchain_ollama.chat_models import ChatOllama
+from langchain_core.utils.function_calling import convert_to_openai_tool
 
 from configs import LLMConfig
+from cache import SQLiteLLMCache
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -23,17 +28,59 @@ def update_base_url(request: httpx.Request, model: str):
             request.url = request.url.copy_with(path="/v1/chat/gpt4-8k")
         else:
             raise Exception(f"Model {model} is not currently supported.")
+
+
+async def aupdate_base_url(request: httpx.Request, model: str):
+    update_base_url(request, model)
         
 
 class BaseGenerator:
     def __init__(self, config: LLMConfig = LLMConfig.default()):
         self.config = config
         self.client = None
+
+        self.cache = SQLiteLLMCache(
+            path=config.cache_path,
+            max_entries=config.cache_max_entries,
+            ttl=config.cache_ttl,
+        ) if config.cache_path else None
     
-    def generate(self, messages: List[Tuple[str]], return_content: bool = True):
-        response = self.client.invoke(messages)
+    def generate(self, messages: List[Tuple[str]], return_content: bool = True, tools: List = None):
+        key = self.get_cache_key(messages, tools) if self.cache else None
+        response = self.cache.get(key) if key else None
+
+        if response is None:
+            client = self.client.bind_tools(tools, strict=True) if tools else self.client
+            response = client.invoke(messages)
+            if key:
+                self.cache.set(key, response)
+
+        return response.content if return_content else response
+
+    async def agenerate(self, messages: List[Tuple[str]], return_content: bool = True, tools: List = None):
+        key = self.get_cache_key(messages, tools) if self.cache else None
+        # The cache does blocking SQLite I/O; keep it off the event loop
+        response = await asyncio.to_thread(self.cache.get, key) if key else None
+
+        if response is None:
+            client = self.client.bind_tools(tools, strict=True) if tools else self.client
+            response = await client.ainvoke(messages)
+            if key:
+                await asyncio.to_thread(self.cache.set, key, response)
+
         return response.content if return_content else response
 
+    def get_cache_key(self, messages: List[Tuple[str]], tools: List = None) -> str:
+        payload = {
+            "generator": type(self).__name__,
+            "model": self.config.model,
+            "temperature": self.config.temperature,
+            "top_p": self.config.top_p,
+            "tools": [convert_to_openai_tool(tool) for tool in tools or []],
+            "messages": [(role, " ".join(content.split())) for role, content in messages],
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
 
 class OpenAIAgent(BaseGenerator):
     def __init__(self, config: LLMConfig = LLMConfig.default()):
@@ -79,5 +126,9 @@ class AzureAIAgent(BaseGenerator):
             event_hooks={
                 "request": [lambda request: update_base_url(request, model=self.config.model)],
             }),
+            http_async_client=httpx.AsyncClient(
+            event_hooks={
+                "request": [lambda request: aupdate_base_url(request, model=self.config.model)],
+            }),
             temperature=self.config.temperature,
         )
\ No newline at end of file
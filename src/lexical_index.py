@@ -0,0 +1,215 @@
+import pickle
+import numpy as np
+from collections import Counter, defaultdict
+from typing import List, Dict, Iterable, Tuple
+
+from langchain.schema.document import Document
+
+from utils import lookup_key
+from rerank import PRUNED, edit_distances
+
+
+def normalize_value(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+class ExactMatchIndex:
+    """
+    Hash index from a case- and whitespace-normalized value to the (table, column, value)
+    triples of the lookup table holding it.
+    """
+    def __init__(self):
+        self._index: Dict[str, List[Tuple[str, str, str]]] = defaultdict(list)
+
+    @classmethod
+    def from_lookup(cls, datapoints: Iterable[Dict], index_field: str = "entity") -> "ExactMatchIndex":
+        index = cls()
+        for datapoint in datapoints:
+            index.add(datapoint[index_field], datapoint["table"], datapoint["column"])
+        return index
+
+    @classmethod
+    def load(cls, path: str) -> "ExactMatchIndex":
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def add(self, value: str, table: str, column: str):
+        entries = self._index[normalize_value(value)]
+        if (table, column, value) not in entries:
+            entries.append((table, column, value))
+
+    def get(self, query: str) -> List[Tuple[str, str, str]]:
+        return list(self._index.get(normalize_value(query), []))
+
+
+class TrigramIndex:
+    """
+    Lexical candidate generator for the lookup table: an inverted index from the character
+    trigrams of every value's `lookup_key` to the sorted ids of the values containing them,
+    stored as one posting array with offsets.
+
+    Trigrams are padded and numbered by occurrence, so a value within edit distance d of a
+    query of length n shares at least max(n, m) + 2 - 3d trigrams with it (m its length).
+    Candidates are verified by exact edit distance in order of that lower bound, until the
+    bound exceeds the current k-th best distance. Values sharing no trigram are never returned.
+    """
+    q = 3
+    batch_size = 256
+
+    def __init__(self):
+        self.values: List[str] = []
+        self.keys: List[str] = []
+        self.sources: List[Tuple[str, str]] = []
+
+        self._vocabulary: Dict[str, int] = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._postings = np.zeros(0, dtype=np.int32)
+        self._lengths = np.zeros(0, dtype=np.int32)
+        self._source_ids = np.zeros(0, dtype=np.int32)
+        self._built = True
+
+    @classmethod
+    def from_lookup(cls, datapoints: Iterable[Dict], index_field: str = "entity") -> "TrigramIndex":
+        index = cls()
+        for datapoint in datapoints:
+            index.add(datapoint[index_field], datapoint["table"], datapoint["column"])
+        index.build()
+        return index
+
+    @classmethod
+    def load(cls, path: str) -> "TrigramIndex":
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def save(self, path: str):
+        self.build()
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    @classmethod
+    def get_grams(cls, key: str) -> List[str]:
+        padded = "$" * (cls.q - 1) + key + "$" * (cls.q - 1)
+        occurrences = Counter()
+        grams = []
+        for start in range(len(padded) - cls.q + 1):
+            gram = padded[start:start + cls.q]
+            occurrences[gram] += 1
+            grams.append(f"{gram}{occurrences[gram]}")
+        return grams
+
+    def add(self, value: str, table: str, column: str):
+        self.values.append(value)
+        self.keys.append(lookup_key(value))
+        self.sources.append((table, column))
+        self._built = False
+
+    def build(self):
+        """
+        Rebuild the posting arrays over all values added so far.
+        """
+        if self._built:
+            return
+
+        gram_ids, value_ids = [], []
+        for value_id, key in enumerate(self.keys):
+            for gram in self.get_grams(key):
+                gram_ids.append(self._vocabulary.setdefault(gram, len(self._vocabulary)))
+                value_ids.append(value_id)
+
+        gram_ids = np.array(gram_ids, dtype=np.int64)
+        value_ids = np.array(value_ids, dtype=np.int32)
+        order = np.lexsort((value_ids, gram_ids))
+
+        self._postings = value_ids[order]
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(gram_ids, minlength=len(self._vocabulary)))])
+        self._lengths = np.array([len(key) for key in self.keys], dtype=np.int32)
+        source_vocabulary = {}
+        self._source_ids = np.array(
+            [source_vocabulary.setdefault(source, len(source_vocabulary)) for source in self.sources], dtype=np.int32,
+        )
+        self._source_vocabulary = source_vocabulary
+        self._built = True
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 100,
+        max_distance: int = None,
+        sources: List[Tuple[str, str]] = None,
+    ) -> List[Document]:
+        """
+        The `top_k` values closest to `query` in edit distance between lookup keys.
+        With `max_distance`, only the posting lists that can hold a value within that distance
+        are scanned (the shortest ones, by pigeonhole), and farther values are dropped.
+        With `sources`, only values of those (table, column) pairs are considered.
+        """
+        self.build()
+        key = lookup_key(query)
+        gram_ids = [self._vocabulary[gram] for gram in self.get_grams(key) if gram in self._vocabulary]
+        postings = sorted(
+            [self._postings[self._offsets[gram_id]:self._offsets[gram_id + 1]] for gram_id in gram_ids], key=len,
+        )
+        if not postings:
+            return []
+
+        scanned = postings
+        if max_distance is not None:
+            required = len(key) + self.q - 1 - self.q * max_distance
+            if required > len(postings):
+                return []
+            if required > 0:
+                scanned = postings[:len(postings) - required + 1]
+
+        candidates = np.unique(np.concatenate(scanned))
+        if sources is not None:
+            allowed = [self._source_vocabulary[source] for source in map(tuple, sources) if source in self._source_vocabulary]
+            candidates = candidates[np.isin(self._source_ids[candidates], allowed)]
+        counts = np.zeros(len(candidates), dtype=np.int32)
+        for posting in postings:
+            counts += np.isin(candidates, posting, assume_unique=True)
+
+        bounds = np.maximum(len(key), self._lengths[candidates]) + self.q - 1 - counts
+        lower_bounds = -(-bounds // self.q)
+        if max_distance is not None:
+            keep = lower_bounds <= max_distance
+            candidates, lower_bounds = candidates[keep], lower_bounds[keep]
+
+        order = np.lexsort((candidates, lower_bounds))
+        candidates, lower_bounds = candidates[order], lower_bounds[order]
+
+        best_ids = np.zeros(0, dtype=np.int32)
+        best_distances = np.zeros(0, dtype=np.int32)
+        for start in range(0, len(candidates), self.batch_size):
+            if len(best_ids) >= top_k and lower_bounds[start] > best_distances[top_k - 1]:
+                break
+
+            batch = candidates[start:start + self.batch_size]
+            distances = edit_distances([key], [[self.keys[idx] for idx in batch]], top_k)[0]
+
+            best_ids = np.concatenate([best_ids, batch])
+            best_distances = np.concatenate([best_distances, distances])
+            order = np.argsort(best_distances, kind="stable")[:top_k]
+            best_ids, best_distances = best_ids[order], best_distances[order]
+
+        best_ids = best_ids[best_distances <= (PRUNED - 1 if max_distance is None else max_distance)]
+
+        return [
+            Document(
+                page_content=self.values[idx],
+                metadata={
+                    "table": self.sources[idx][0],
+                    "column": self.sources[idx][1],
+                    "lookup_key": self.keys[idx],
+                },
+            ) for idx in best_ids
+        ]
@@ -0,0 +1,249 @@
+import os
+import json
+import uuid
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Iterator, Tuple
+
+from tqdm import tqdm
+
+from retriever import BaseRetriever
+from utils import lookup_key, connect_readonly
+
+
+# Columns whose name contains any of these are not ingested (dates, codes, units)
+DEFAULT_IGNORED_COLUMNS = ["TIME", "DOB", "DOD", "CODE", "DRUG_DOSE", "VALUE_UNIT"]
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class LookupBuilder:
+    """
+    Builds the lookup collection from the distinct text values of a SQLite database.
+
+    Each (table, column) is streamed with `fetchmany` on its own connection and ingested in
+    batches as values arrive, several columns at a time. Finished columns are recorded in
+    `checkpoint_path`; a restarted build skips them, and the deterministic point IDs of
+    `bulk_ingest` make the interrupted column cheap to redo.
+
+    The point IDs of each column are also kept next to the checkpoint, with their fingerprint
+    in it, so that `sync` can later apply only the values added to or removed from the database.
+    """
+    def __init__(
+        self,
+        lookup_table: BaseRetriever,
+        db_file: str,
+        ignored_columns: List[str] = DEFAULT_IGNORED_COLUMNS,
+        index_field: str = "entity",
+        checkpoint_path: str = None,
+        fetch_size: int = 10000,
+        max_workers: int = 4,
+    ):
+        self.lookup_table = lookup_table
+        self.db_file = db_file
+        self.ignored_columns = ignored_columns
+        self.index_field = index_field
+        self.checkpoint_path = checkpoint_path
+        self.fetch_size = fetch_size
+        self.max_workers = max_workers
+
+        self._lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        return connect_readonly(self.db_file)
+
+    def get_columns(self) -> List[Tuple[str, str]]:
+        """
+        (table, column) pairs to ingest, ignored columns excluded.
+        """
+        conn = self.connect()
+        try:
+            tables = [row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+            )]
+            columns = []
+            for table in tables:
+                for row in conn.execute(f"PRAGMA table_info({quote_identifier(table)})"):
+                    if not any(ignored in row[1] for ignored in self.ignored_columns):
+                        columns.append((table, row[1]))
+            return columns
+        finally:
+            conn.close()
+
+    def iter_values(self, table: str, column: str) -> Iterator[str]:
+        conn = self.connect()
+        try:
+            cursor = conn.execute(
+                f"SELECT DISTINCT {quote_identifier(column)} FROM {quote_identifier(table)} "
+                f"WHERE typeof({quote_identifier(column)}) = 'text'"
+            )
+            while True:
+                rows = cursor.fetchmany(self.fetch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row[0]
+        finally:
+            conn.close()
+
+    def iter_datapoints(self, table: str = None, column: str = None) -> Iterator[Dict]:
+        """
+        Lookup datapoints of one column, or of every column when none is given.
+        """
+        columns = [(table, column)] if table is not None else self.get_columns()
+        for table, column in columns:
+            for value in self.iter_values(table, column):
+                yield {
+                    self.index_field: value,
+                    "table": table,
+                    "column": column,
+                    "lookup_key": lookup_key(value),
+                }
+
+    @staticmethod
+    def get_column_key(table: str, column: str) -> str:
+        return f"{table}.{column}"
+
+    def get_point_id(self, datapoint: Dict) -> bytes:
+        metadata = {key: value for key, value in datapoint.items() if key != self.index_field}
+        return uuid.UUID(BaseRetriever.get_document_id(datapoint[self.index_field], metadata)).bytes
+
+    @staticmethod
+    def to_id_array(ids: List[bytes]) -> np.ndarray:
+        return np.unique(np.frombuffer(b"".join(ids), dtype="V16"))
+
+    @staticmethod
+    def get_fingerprint(ids: np.ndarray) -> str:
+        return hashlib.blake2b(ids.tobytes(), digest_size=16).hexdigest()
+
+    def get_ids_path(self, key: str) -> str:
+        return os.path.join(os.path.splitext(self.checkpoint_path)[0] + "_ids", key + ".ids")
+
+    def load_ids(self, key: str) -> np.ndarray:
+        if self.checkpoint_path and os.path.exists(self.get_ids_path(key)):
+            return np.fromfile(self.get_ids_path(key), dtype="V16")
+        return np.zeros(0, dtype="V16")
+
+    def save_ids(self, key: str, ids: np.ndarray):
+        if self.checkpoint_path is None:
+            return
+        path = self.get_ids_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        ids.tofile(path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+    def load_checkpoint(self) -> Dict:
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, "r") as f:
+                return json.load(f)
+        return {}
+
+    def save_checkpoint(self, checkpoint: Dict):
+        if self.checkpoint_path is None:
+            return
+        if os.path.dirname(self.checkpoint_path):
+            os.makedirs(os.path.dirname(self.checkpoint_path), exist_ok=True)
+        with self._lock:
+            with open(self.checkpoint_path + ".tmp", "w") as f:
+                json.dump(checkpoint, f, indent=2)
+            os.replace(self.checkpoint_path + ".tmp", self.checkpoint_path)
+
+    def create_payload_indexes(self):
+        for field in ["table", "column"]:
+            self.lookup_table.create_payload_index(field)
+
+    def build_column(self, table: str, column: str) -> Dict:
+        ids = []
+
+        def datapoints():
+            for datapoint in self.iter_datapoints(table, column):
+                ids.append(self.get_point_id(datapoint))
+                yield datapoint
+
+        stats = self.lookup_table.bulk_ingest(datapoints(), self.index_field, show_progress=False)
+        ids = self.to_id_array(ids)
+        self.save_ids(self.get_column_key(table, column), ids)
+        return {**stats, "values": len(ids), "fingerprint": self.get_fingerprint(ids)}
+
+    def sync_column(self, table: str, column: str, previous: Dict = None) -> Dict:
+        """
+        Bring one column of the collection in line with the database: ingest the values whose
+        point ID is new and delete the points whose value is gone. Unchanged columns (same
+        fingerprint as `previous`) cost one scan of their distinct values.
+        """
+        key = self.get_column_key(table, column)
+        ids = self.to_id_array([self.get_point_id(datapoint) for datapoint in self.iter_datapoints(table, column)])
+        fingerprint = self.get_fingerprint(ids)
+        if previous and previous.get("fingerprint") == fingerprint:
+            return {**previous, "added": 0, "removed": 0}
+
+        old_ids = self.load_ids(key)
+        added = set(np.setdiff1d(ids, old_ids).tolist())
+        removed = np.setdiff1d(old_ids, ids)
+
+        stats = self.lookup_table.bulk_ingest(
+            (datapoint for datapoint in self.iter_datapoints(table, column) if self.get_point_id(datapoint) in added),
+            self.index_field,
+            show_progress=False,
+        ) if added else {}
+        if len(removed):
+            self.lookup_table.delete([str(uuid.UUID(bytes=bytes(point_id))) for point_id in removed])
+
+        self.save_ids(key, ids)
+        return {**stats, "values": len(ids), "fingerprint": fingerprint, "added": len(added), "removed": len(removed)}
+
+    def build(self, show_progress: bool = True) -> Dict:
+        """
+        Ingest every column not already in the checkpoint. Returns the checkpoint,
+        i.e. the ingestion stats of each finished column keyed by "table.column".
+        """
+        checkpoint = self.load_checkpoint()
+        self.create_payload_indexes()
+        columns = [(table, column) for table, column in self.get_columns() if f"{table}.{column}" not in checkpoint]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.build_column, table, column): (table, column) for table, column in columns}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Columns", disable=not show_progress):
+                table, column = futures[future]
+                checkpoint[self.get_column_key(table, column)] = future.result()
+                self.save_checkpoint(checkpoint)
+
+        return checkpoint
+
+    def sync(self, show_progress: bool = True) -> Dict:
+        """
+        Incremental refresh of a built collection: every column is diffed against the point IDs
+        recorded at its last build or sync, and columns no longer selected are deleted.
+        Needs `checkpoint_path`; without it nothing is known to be ingested, so nothing is deleted.
+        Returns the checkpoint, with the added and removed counts of each column.
+        """
+        checkpoint = self.load_checkpoint()
+        self.create_payload_indexes()
+        columns = self.get_columns()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self.sync_column, table, column, checkpoint.get(self.get_column_key(table, column))): (table, column)
+                for table, column in columns
+            }
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Columns", disable=not show_progress):
+                table, column = futures[future]
+                checkpoint[self.get_column_key(table, column)] = future.result()
+                self.save_checkpoint(checkpoint)
+
+        current = {self.get_column_key(table, column) for table, column in columns}
+        for key in [key for key in checkpoint if key not in current]:
+            removed = self.load_ids(key)
+            if len(removed):
+                self.lookup_table.delete([str(uuid.UUID(bytes=bytes(point_id))) for point_id in removed])
+            if os.path.exists(self.get_ids_path(key)):
+                os.remove(self.get_ids_path(key))
+            del checkpoint[key]
+            self.save_checkpoint(checkpoint)
+
+        return checkpoint
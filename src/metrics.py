@@ -1,10 +1,11 @@
 from typing import List, Dict
 from langchain_community.utilities.sql_database import SQLDatabase
 from src.utils import *
+from src.cache import SQLExecutionCache
 import re
 import sqlite3
 
-def execution_accuracy(sql_db: SQLDatabase, results_dataset: List[Dict]):
+def execution_accuracy(sql_db: SQLDatabase, results_dataset: List[Dict], sql_cache: SQLExecutionCache = None):
     count = 0
     error = [] 
     success = []
@@ -14,7 +15,7 @@ def execution_accuracy(sql_db: SQLDatabase, results_dataset: List[Dict]):
         outPred = item["sql_response"]
 
         try:
-            outTtt = sql_db.run(ttt)
+            outTtt = sql_cache.run(sql_db, ttt) if sql_cache is not None else sql_db.run(ttt)
         except:
             continue
         if outPred == outTtt:
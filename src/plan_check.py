@@ -0,0 +1,155 @@
+import re
+import time
+import sqlite3
+import threading
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Sequence
+
+from langchain_community.utilities.sql_database import SQLDatabase
+
+from utils import get_data_version, get_sqlite_file, connect_readonly
+
+
+PLAN_ISSUES = ("full_scan", "unindexed_join", "automatic_index")
+SCAN_PATTERN = re.compile(r"^SCAN (?:TABLE )?(\w+)", re.IGNORECASE)
+AUTOMATIC_INDEX_PATTERN = re.compile(r"^SEARCH (?:TABLE )?(\w+) USING AUTOMATIC", re.IGNORECASE)
+
+
+@dataclass
+class PlanCheck:
+    """
+    Verdict of the planner check: ok, flagged (issues found, none rejecting), rejected,
+    error (the query could not be planned) or skipped (not a SQLite database).
+    """
+    verdict: str
+    issues: List[Dict] = field(default_factory=list)
+    plan: List[str] = field(default_factory=list)
+    elapsed: float = 0.
+    error: Optional[str] = None
+
+    @property
+    def rejected(self) -> bool:
+        return self.verdict == "rejected"
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+class QueryPlanChecker:
+    """
+    Reads `EXPLAIN QUERY PLAN` of a query before it runs, and reports the loops over tables
+    of at least `large_table_rows` rows that no index serves: "full_scan" for the outer loop
+    of a SELECT, "unindexed_join" for a nested scan (a cross join), and "automatic_index" for
+    a join SQLite serves with an index it builds for this query alone (about N log N, the
+    usual shape of joins on unindexed keys). Issues whose kind is in `reject` reject the query.
+    Table sizes come from `sqlite_stat1` when the database was analyzed, else from the
+    largest rowid, and are refreshed when the database changes.
+    """
+    def __init__(
+        self,
+        sql_db: SQLDatabase,
+        large_table_rows: int = 100000,
+        reject: Sequence[str] = ("unindexed_join",),
+    ):
+        for kind in reject:
+            if kind not in PLAN_ISSUES:
+                raise ValueError(f"Unknown plan issue: {kind}")
+
+        self.sql_db = sql_db
+        self.large_table_rows = large_table_rows
+        self.reject = tuple(reject)
+
+        self.db_file = get_sqlite_file(sql_db)
+
+        self._lock = threading.Lock()
+        self._table_rows = {}
+        self._db_version = None
+
+    def connect(self) -> sqlite3.Connection:
+        return connect_readonly(self.db_file)
+
+    def get_table_rows(self) -> Dict[str, int]:
+        db_version = get_data_version(self.sql_db)
+        with self._lock:
+            if db_version != self._db_version:
+                self._table_rows = self._count_rows()
+                self._db_version = db_version
+            return self._table_rows
+
+    def _count_rows(self) -> Dict[str, int]:
+        connection = self.connect()
+        try:
+            tables = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            table_rows = {}
+            if "sqlite_stat1" in tables:
+                for table, stat in connection.execute("SELECT tbl, stat FROM sqlite_stat1"):
+                    table_rows[table.lower()] = max(table_rows.get(table.lower(), 0), int(stat.split()[0]))
+
+            for table in tables:
+                if table.lower() in table_rows or table.startswith("sqlite_"):
+                    continue
+                quoted = '"' + table.replace('"', '""') + '"'
+                try:
+                    count = connection.execute(f"SELECT MAX(rowid) FROM {quoted}").fetchone()[0]
+                except sqlite3.OperationalError:
+                    # WITHOUT ROWID table
+                    count = connection.execute(f"SELECT COUNT(*) FROM {quoted}").fetchone()[0]
+                table_rows[table.lower()] = count or 0
+            return table_rows
+        finally:
+            connection.close()
+
+    @staticmethod
+    def resolve_table(sql: str, name: str, table_rows: Dict[str, int]) -> str:
+        """
+        Table behind a name of the plan, which is the alias when the query gives one.
+        """
+        if name.lower() in table_rows:
+            return name.lower()
+        for match in re.finditer(rf'"?(\w+)"?\s+(?:AS\s+)?"?{re.escape(name)}"?(?!\w)', sql, re.IGNORECASE):
+            if match.group(1).lower() in table_rows:
+                return match.group(1).lower()
+        return name.lower()
+
+    def check(self, sql: str) -> PlanCheck:
+        if self.db_file is None:
+            return PlanCheck("skipped")
+
+        start = time.perf_counter()
+        table_rows = self.get_table_rows()
+        connection = self.connect()
+        try:
+            plan = connection.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+        except sqlite3.Error as e:
+            return PlanCheck("error", elapsed=time.perf_counter() - start, error=str(e))
+        finally:
+            connection.close()
+
+        issues, outer_loops = [], set()
+        for node_id, parent_id, _, detail in plan:
+            match = SCAN_PATTERN.match(detail) or AUTOMATIC_INDEX_PATTERN.match(detail)
+            is_loop = match is not None or detail.upper().startswith("SEARCH ")
+            if not is_loop:
+                continue
+
+            nested = parent_id in outer_loops
+            outer_loops.add(parent_id)
+            if match is None:
+                continue
+
+            table = self.resolve_table(sql, match.group(1), table_rows)
+            rows = table_rows.get(table, 0)
+            if rows < self.large_table_rows:
+                continue
+
+            if detail.upper().startswith("SEARCH "):
+                kind = "automatic_index"
+            else:
+                kind = "unindexed_join" if nested else "full_scan"
+            issues.append({"kind": kind, "table": table, "rows": rows, "detail": detail})
+
+        if any(issue["kind"] in self.reject for issue in issues):
+            verdict = "rejected"
+        else:
+            verdict = "flagged" if issues else "ok"
+        return PlanCheck(verdict, issues, [row[3] for row in plan], time.perf_counter() - start)
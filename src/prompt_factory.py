@@ -51,6 +51,15 @@ You are given a SQL template and a corresponding natural language question. Your
 - Your output should be only the SQL query, with no comments, markdown, explanations, or formatting. Do not wrap the code in markdown tags.
 """
 
+plan_repair = """
+Given a question, a SQL query answering it and problems found in the query plan of that query, rewrite the query so that the database does not have to loop over large tables without an index.
+
+# Instructions:
+- Keep the meaning of the query: same tables, conditions and returned columns.
+- Avoid cross joins and joins on columns that are not keys; filter each table before joining it when possible.
+- Your output should be only the SQL query, with no comments, markdown, explanations, or formatting.
+"""
+
 question_answering = """
 Given the question and the retrieved data, address the given question.
 - Always respond with the retrieved data, even if it does not make sense in terms of common sense (e.g., a patient has age 0).
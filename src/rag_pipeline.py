@@ -1,19 +1,76 @@
 
-import nltk
 import json
-from typing import Tuple, List, Dict
+import asyncio
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, List, Dict, Callable, Optional
 
 from utils import *
-import prompt_factory 
+import prompt_factory
 from retriever import BaseRetriever
 from generator import BaseGenerator
 from configs import RAGConfig
 from schema import MaskingResults
+from schema_context import SchemaContext
+from substitution import substitute_sources, swap_values
+from gazetteer import GazetteerExtractor, DEFAULT_COLUMN_LABELS, get_label_sources
+from lexical_index import ExactMatchIndex, TrigramIndex, normalize_value
+from rerank import edit_distances
+from cache import AnswerCache, SQLExecutionCache
+from sql_executor import SQLExecutor, ExecutionResult, run_unguarded
+from plan_check import QueryPlanChecker, PlanCheck
 
 from langchain.callbacks import get_openai_callback
+from langchain.schema.document import Document
 from langchain_community.utilities.sql_database import SQLDatabase
 
 
+MASKED_LABELS = [
+    "CONDITION", "PROCEDURE", "ETHNICITY",
+    "DRUG", "NAME", "RELIGION", "EQUIPMENT",
+]
+
+
+def get_token_usage(cb) -> Dict:
+    return {
+        "total_tokens": cb.total_tokens,
+        "prompt_tokens": cb.prompt_tokens,
+        "completion_tokens": cb.completion_tokens,
+        "successful_requests": cb.successful_requests,
+    }
+
+
+def get_discovery_path(relevant_entity_match: List[Dict]) -> str:
+    paths = {entity_match.get("resolved_by") for entity_match in relevant_entity_match} - {None}
+    if not paths:
+        return "none"
+    return paths.pop() if len(paths) == 1 else "hybrid"
+
+
+def merge_token_usage(*usages: Dict) -> Dict:
+    return {
+        key: sum(usage[key] for usage in usages)
+        for key in ["total_tokens", "prompt_tokens", "completion_tokens", "successful_requests"]
+    }
+
+
+def run_concurrently(fn: Callable, args_list: List[Tuple], max_concurrency: int) -> List[Tuple]:
+    """
+    Call `fn(*args)` for every entry on a thread pool, keeping input order.
+    Returns (output, error, token_usage) per entry; one failure does not stop the others.
+    """
+    def worker(args):
+        with get_openai_callback() as cb:
+            try:
+                output, error = fn(*args), None
+            except Exception as e:
+                output, error = None, e
+        return output, error, get_token_usage(cb)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        return list(pool.map(worker, args_list))
+
+
 class RAG2SQL:
     def __init__(
         self,
@@ -27,65 +84,233 @@ class RAG2SQL:
         self.sql_db = sql_db
 
         self.config = config
+        self.schema_context = SchemaContext(sql_db, pruned=config.schema_pruning)
+        self.sql_cache = SQLExecutionCache(config.sql_cache_max_bytes) if config.sql_cache else None
+        self.sql_executor = SQLExecutor(
+            sql_db,
+            timeout=config.sql_timeout,
+            max_rows=config.sql_max_rows,
+            memory_limit=config.sql_memory_limit,
+        ) if config.guarded_execution else None
+        self.plan_checker = QueryPlanChecker(
+            sql_db,
+            large_table_rows=config.plan_check_large_table,
+            reject=config.plan_check_reject,
+        ) if config.plan_check else None
+
+        if config.plan_repair not in ("llm", None):
+            raise ValueError(f"Unknown plan repair: {config.plan_repair}")
 
     def query(self, query: str) -> Dict:
         with get_openai_callback() as cb:
-            sql_query, retrieved_cases = self.formulate_sql_query(query)
-            try:
-                sql_response = self.sql_db.run(sql_query)
-            except: 
-                sql_response = "DATA FAILED"
-
-            messages = [
-                ("system", prompt_factory.question_answering),
-                ("human", f"Question: {query}"),
-                ("human", f"Retrieved Data: {sql_response}"),
-                ("human", f"Answer:"),
-            ]
-            response = self.generator.generate(messages) if self.config.return_response else None
+            result = self.complete_query(query)
+
+        result["token_usage"] = get_token_usage(cb)
+        return result
+
+    def complete_query(self, query: str, retrieved_cases: List = None) -> Dict:
+        sql_query, retrieved_cases = self.formulate_sql_query(query, retrieved_cases)
+        sql_query, execution, plan_check = self.check_and_execute(query, sql_query)
+        sql_response = execution.response
+        response = self.generator.generate(self.get_answer_messages(query, sql_response)) if self.config.return_response else None
 
         return {
             "response": response,
             "sql_query": sql_query,
             "sql_response": sql_response,
+            "execution": execution.to_dict(),
+            "plan_check": plan_check,
             "retrieved_cases": retrieved_cases,
-            "token_usage": {
-                "total_tokens": cb.total_tokens,
-                "prompt_tokens": cb.prompt_tokens,
-                "completion_tokens": cb.completion_tokens,
-                "successful_requests": cb.successful_requests,
-            }
         }
-    
-    def formulate_sql_query(self, query: str):
-        # Retrieve
-        retrieved_cases = self.retriever.retrieve(query, top_k=self.config.top_k) 
 
+    def query_batch(self, queries: List[str], max_concurrency: int = 8) -> List[Dict]:
+        """
+        Answer a list of questions. Case retrieval is done in one batch, the LLM stages
+        run on a pool of `max_concurrency` workers. Results keep the input order, and
+        a failing question gets an `error` entry instead of aborting the batch.
+        """
+        retrieved_cases = self.retrieve_cases_batch(queries)
+        outputs = run_concurrently(self.complete_query, list(zip(queries, retrieved_cases)), max_concurrency)
+
+        results = []
+        for output, error, token_usage in outputs:
+            result = output if error is None else self.get_failed_result(error)
+            result["token_usage"] = token_usage
+            results.append(result)
+        return results
+
+    def get_failed_result(self, error: Exception) -> Dict:
+        return {
+            "error": str(error),
+            "response": None,
+            "sql_query": "",
+            "sql_response": "",
+            "execution": None,
+            "plan_check": None,
+            "retrieved_cases": [],
+        }
+
+    async def aquery(self, query: str) -> Dict:
+        with get_openai_callback() as cb:
+            sql_query, retrieved_cases = await self.aformulate_sql_query(query)
+            sql_query, execution, plan_check = await asyncio.to_thread(self.check_and_execute, query, sql_query)
+            sql_response = execution.response
+            response = await self.generator.agenerate(self.get_answer_messages(query, sql_response)) if self.config.return_response else None
+
+        return {
+            "response": response,
+            "sql_query": sql_query,
+            "sql_response": sql_response,
+            "execution": execution.to_dict(),
+            "plan_check": plan_check,
+            "retrieved_cases": retrieved_cases,
+            "token_usage": get_token_usage(cb),
+        }
+
+    def check_and_execute(self, query: str, sql_query: str) -> Tuple[str, ExecutionResult, Optional[Dict]]:
+        """
+        Execute a generated query after the planner check (when configured). A rejected query
+        goes to `repair_sql` instead of the database, up to `plan_repair_attempts` times, and
+        is not executed if no repair passes the check.
+        """
+        if self.plan_checker is None:
+            return sql_query, self.execute_sql(sql_query), None
+
+        plan_check = self.plan_checker.check(sql_query)
+        repairs = 0
+        while plan_check.rejected and repairs < self.config.plan_repair_attempts:
+            repaired_sql = self.repair_sql(query, sql_query, plan_check)
+            if repaired_sql is None:
+                break
+            repairs += 1
+            sql_query = repaired_sql
+            plan_check = self.plan_checker.check(sql_query)
+
+        if plan_check.rejected:
+            issues = ", ".join(
+                f"{issue['kind']} on {issue['table']}"
+                for issue in plan_check.issues if issue["kind"] in self.plan_checker.reject
+            )
+            execution = ExecutionResult("rejected", "DATA FAILED", error=f"Rejected query plan: {issues}")
+        else:
+            execution = self.execute_sql(sql_query)
+        return sql_query, execution, {**plan_check.to_dict(), "repairs": repairs}
+
+    def repair_sql(self, query: str, sql_query: str, plan_check: PlanCheck) -> Optional[str]:
+        if self.config.plan_repair is None:
+            return None
+        sql_query = self.generator.generate(self.get_plan_repair_messages(query, sql_query, plan_check))
+        return remove_sql_wrapper(sql_query)
+
+    def get_plan_repair_messages(self, query: str, sql_query: str, plan_check: PlanCheck) -> List[Tuple[str]]:
+        issues = "\n".join(
+            f"- {issue['kind']} over table {issue['table']} ({issue['rows']} rows): {issue['detail']}"
+            for issue in plan_check.issues
+        )
+        return [
+            ("system", prompt_factory.plan_repair),
+            ("system", f"Schema Information:{self.schema_context.get_table_info(sql_queries=[sql_query])}"),
+            ("human", f"Question: {query}"),
+            ("human", f"SQL Query: {sql_query}"),
+            ("human", f"Query Plan Problems:\n{issues}"),
+            ("human", f"Revised SQL Query:"),
+        ]
+
+    def execute_sql(self, sql_query: str) -> ExecutionResult:
+        """
+        Run a query through the execution cache and, with `guarded_execution`, the limits of
+        the SQL executor. Failures are reported in the status instead of raised.
+        """
+        # Rows are only cached for databases whose data changes can be detected
+        db_version = get_data_version(self.sql_db) if self.sql_cache is not None else None
+        if db_version is not None:
+            cached = self.sql_cache.get(sql_query, db_version)
+            if cached is not None:
+                return ExecutionResult("ok", cached, cached=True)
+
+        if self.sql_executor is not None:
+            execution = self.sql_executor.execute(sql_query)
+        else:
+            execution = run_unguarded(self.sql_db, sql_query)
+
+        if db_version is not None and execution.ok:
+            self.sql_cache.set(sql_query, db_version, execution.response)
+        return execution
+
+    def get_answer_messages(self, query: str, sql_response: str) -> List[Tuple[str]]:
+        return [
+            ("system", prompt_factory.question_answering),
+            ("human", f"Question: {query}"),
+            ("human", f"Retrieved Data: {sql_response}"),
+            ("human", f"Answer:"),
+        ]
+
+    def retrieve_cases(self, query: str) -> List:
+        return self.prepare_cases(self.retriever.retrieve(query, top_k=self.config.top_k))
+
+    def retrieve_cases_batch(self, queries: List[str]) -> List[Optional[List]]:
+        """
+        Cases of a batch of questions in one retrieval call. If that call fails, every entry
+        is None and each question retrieves its own cases in its worker, where an error only
+        fails that question.
+        """
+        try:
+            return [self.prepare_cases(cases) for cases in self.retriever.retrieve_many(queries, top_k=self.config.top_k)]
+        except Exception:
+            return [None] * len(queries)
+
+    async def aretrieve_cases(self, query: str) -> List:
+        return self.prepare_cases(await self.retriever.aretrieve(query, top_k=self.config.top_k))
+
+    def prepare_cases(self, retrieved_cases: List) -> List:
         if self.config.brittle_retrieval:
             retrieved_cases = drop_cases(retrieved_cases)
+        return retrieved_cases
+
+    def formulate_sql_query(self, query: str, retrieved_cases: List = None):
+        # Retrieve
+        if retrieved_cases is None:
+            retrieved_cases = self.retrieve_cases(query)
 
+        # Revise
+        messages = self.get_revising_messages(query, retrieved_cases)
+        sql_query = self.generator.generate(messages)
+        return remove_sql_wrapper(sql_query), retrieved_cases
+
+    async def aformulate_sql_query(self, query: str, retrieved_cases: List = None):
+        if retrieved_cases is None:
+            retrieved_cases = await self.aretrieve_cases(query)
+
+        messages = self.get_revising_messages(query, retrieved_cases)
+        sql_query = await self.generator.agenerate(messages)
+        return remove_sql_wrapper(sql_query), retrieved_cases
+
+    def get_revising_messages(self, query: str, retrieved_cases: List) -> List[Tuple[str]]:
         formatted_string = "\n\n".join(
             f"Query: {doc.page_content}\nSQL Query: {doc.metadata['sql_query']}" for doc in retrieved_cases
         )
 
-        # Revise
-        messages = [
+        return [
             ("system", prompt_factory.case_revising),
-            ("system", f"Schema Information:{self.sql_db.get_table_info()}"),
+            ("system", f"Schema Information:{self.get_table_info(retrieved_cases)}"),
             ("human", f"Question: {query}"),
             ("human", f"Past SQL Examples: {formatted_string}"),
             ("human", f"Revised SQL Query:"),
         ]
-        sql_query = self.generator.generate(messages) 
-        return remove_sql_wrapper(sql_query), retrieved_cases
-    
+
+    def get_table_info(self, retrieved_cases: List, relevant_entity_match: List[Dict] = ()) -> str:
+        return self.schema_context.get_table_info(
+            sql_queries=[doc.metadata["sql_query"] for doc in retrieved_cases],
+            entity_matches=relevant_entity_match,
+        )
+
     def retain(self, query: str, correct_sql: str):
         documents = [{
             "case": query,
             "sql_query": correct_sql,
         }]
         self.retriever.ingest(documents, "case")
-    
+
 
 class CBR2SQL(RAG2SQL):
     def __init__(
@@ -95,51 +320,259 @@ class CBR2SQL(RAG2SQL):
         sql_db: SQLDatabase,
         lookup_table: BaseRetriever,
         config: RAGConfig = RAGConfig.default(),
+        entity_extractor: GazetteerExtractor = None,
+        exact_index: ExactMatchIndex = None,
+        trigram_index: TrigramIndex = None,
+        label_sources: Dict[str, List[Tuple[str, str]]] = None,
     ):
         super().__init__(retriever, generator, sql_db, config)
         self.lookup_table = lookup_table
+        self.entity_extractor = entity_extractor
+        self.exact_index = exact_index
+        self.trigram_index = trigram_index
+        self.label_sources = label_sources if label_sources is not None else get_label_sources(DEFAULT_COLUMN_LABELS)
+
+        if self.config.lookup_engine not in ("dense", "trigram", "hybrid"):
+            raise ValueError(f"Unknown lookup engine: {self.config.lookup_engine}")
+        if self.config.lookup_engine != "dense" and trigram_index is None:
+            raise ValueError(f"Lookup engine {self.config.lookup_engine} needs a trigram index")
+
+        self.answer_cache = AnswerCache(
+            max_entries=self.config.answer_cache_max_entries,
+            embedder=self.retriever.embedder,
+            similarity_threshold=self.config.answer_cache_similarity,
+        ) if self.config.answer_cache else None
 
     def query(self, query: str) -> Dict:
         with get_openai_callback() as cb:
             masked_query, extracted_entities = self.get_masked_question(query)
-            
+            result = self.complete_query(query, masked_query, extracted_entities)
+
+        result["token_usage"] = get_token_usage(cb)
+        return result
+
+    def complete_query(
+        self,
+        query: str,
+        masked_query: str,
+        extracted_entities: List[Dict],
+        retrieved_cases: List = None,
+    ) -> Dict:
+        # Lookups come first so that a pruned schema can include the matched columns
+        relevant_entity_match = self.match_entities(extracted_entities) if self.config.source_discovery else []
+
+        answer_key = self.get_answer_key(masked_query, extracted_entities, relevant_entity_match)
+        cached_result = self.get_cached_answer(query, answer_key)
+        if cached_result is not None:
+            return cached_result
+
+        sql_query = None
+        if self.config.template_construction:
+            if retrieved_cases is None:
+                retrieved_cases = self.retrieve_cases(masked_query)
+
+            sql_query = self.reuse_case_sql(extracted_entities, retrieved_cases)
+            case_reuse = sql_query is not None
+            if not case_reuse:
+                sql_query, retrieved_cases = self.formulate_sql_template(
+                    query, masked_query, extracted_entities, retrieved_cases, relevant_entity_match,
+                )
+        else:
+            case_reuse = False
+            sql_query, retrieved_cases = self.formulate_sql_query(query, retrieved_cases)
+
+        if self.config.source_discovery:
+            sql_query, relevant_entity_match = self.discover_sources(
+                query, sql_query, extracted_entities, relevant_entity_match,
+            )
+
+        sql_query, execution, plan_check = self.check_and_execute(query, sql_query)
+        sql_response = execution.response
+        response = self.generator.generate(self.get_answer_messages(query, sql_response)) if self.config.return_response else None
+
+        result = {
+            "response": response,
+            "sql_query": sql_query,
+            "sql_response": sql_response,
+            "execution": execution.to_dict(),
+            "plan_check": plan_check,
+            "retrieved_cases": retrieved_cases,
+            "relevant_entities": relevant_entity_match,
+            "case_reuse": case_reuse,
+            "source_discovery": get_discovery_path(relevant_entity_match),
+            "answer_cache": None,
+        }
+        self.store_answer(answer_key, result)
+        return result
+
+    def get_answer_key(
+        self,
+        masked_query: str,
+        extracted_entities: List[Dict],
+        relevant_entity_match: List[Dict],
+    ) -> Tuple[str, Tuple]:
+        """
+        Answer cache key: the normalized masked question, and for every entity its label and
+        the value it resolves to (best lookup match, or its normalized text without matches).
+        """
+        best_matches = {
+            entity_match["entity"]: entity_match["matches"][0]
+            for entity_match in relevant_entity_match if entity_match["matches"]
+        }
+        signature = tuple(
+            (
+                entity["label"],
+                (
+                    best_matches[entity["value"]]["page_content"],
+                    best_matches[entity["value"]]["metadata"]["table"],
+                    best_matches[entity["value"]]["metadata"]["column"],
+                ) if entity["value"] in best_matches else normalize_value(entity["value"]),
+            ) for entity in extracted_entities
+        )
+        return " ".join(tokenize(masked_query)), signature
+
+    def get_cached_answer(self, query: str, answer_key: Tuple[str, Tuple]) -> Optional[Dict]:
+        """
+        The cached result of an equivalent question. Its stored rows are returned while the
+        database is unchanged; otherwise, or when the database has no data version, only
+        its SQL is executed again.
+        """
+        if self.answer_cache is None:
+            return None
+
+        cached = self.answer_cache.get(*answer_key)
+        if cached is None:
+            return None
+
+        entry, tier = cached
+        result = {**entry["result"], "answer_cache": tier}
+
+        db_version = get_data_version(self.sql_db)
+        if db_version is None or entry["db_version"] != db_version:
+            execution = self.execute_sql(result["sql_query"])
+            result["sql_response"] = execution.response
+            result["execution"] = execution.to_dict()
+            result["response"] = self.generator.generate(
+                self.get_answer_messages(query, result["sql_response"])
+            ) if self.config.return_response else None
+            self.store_answer(answer_key, result, db_version)
+        return result
+
+    def store_answer(self, answer_key: Tuple[str, Tuple], result: Dict, db_version=None):
+        if self.answer_cache is None or result["sql_response"] == "DATA FAILED":
+            return
+        self.answer_cache.set(
+            *answer_key,
+            {**result, "answer_cache": None},
+            db_version if db_version is not None else get_data_version(self.sql_db),
+        )
+
+    def query_batch(self, queries: List[str], max_concurrency: int = 8) -> List[Dict]:
+        """
+        Answer a list of questions stage by stage: masking on the worker pool, one
+        batched case retrieval over all masked questions, then the remaining stages
+        on the worker pool. Results keep the input order.
+        """
+        results = [None] * len(queries)
+        token_usage = [None] * len(queries)
+
+        maskings = run_concurrently(self.get_masked_question, [(query,) for query in queries], max_concurrency)
+        pending = []
+        for idx, (output, error, usage) in enumerate(maskings):
+            token_usage[idx] = usage
+            if error is None:
+                pending.append((idx, *output))
+            else:
+                results[idx] = self.get_failed_result(error)
+
+        retrieval_queries = [
+            masked_query if self.config.template_construction else queries[idx]
+            for idx, masked_query, _ in pending
+        ]
+        retrieved_cases = self.retrieve_cases_batch(retrieval_queries)
+
+        outputs = run_concurrently(
+            self.complete_query,
+            [
+                (queries[idx], masked_query, extracted_entities, cases)
+                for (idx, masked_query, extracted_entities), cases in zip(pending, retrieved_cases)
+            ],
+            max_concurrency,
+        )
+        for (idx, _, _), (output, error, usage) in zip(pending, outputs):
+            results[idx] = output if error is None else self.get_failed_result(error)
+            token_usage[idx] = merge_token_usage(token_usage[idx], usage)
+
+        for result, usage in zip(results, token_usage):
+            result["token_usage"] = usage
+        return results
+
+    def get_failed_result(self, error: Exception) -> Dict:
+        return {
+            **super().get_failed_result(error),
+            "relevant_entities": [],
+            "case_reuse": False,
+            "source_discovery": "none",
+            "answer_cache": None,
+        }
+
+    async def aquery(self, query: str) -> Dict:
+        """
+        Same as `query`, but entity lookups run concurrently with template formulation
+        (unless schema pruning needs the lookup matches first).
+        """
+        with get_openai_callback() as cb:
+            masked_query, extracted_entities = await self.aget_masked_question(query)
+
+            matching = asyncio.create_task(self.amatch_entities(extracted_entities)) if self.config.source_discovery else None
+            schema_matches = await matching if matching is not None and self.config.schema_pruning else ()
+
+            answer_key = None
+            if self.answer_cache is not None:
+                answer_key = self.get_answer_key(masked_query, extracted_entities, await matching if matching is not None else [])
+                cached_result = await asyncio.to_thread(self.get_cached_answer, query, answer_key)
+                if cached_result is not None:
+                    return {**cached_result, "token_usage": get_token_usage(cb)}
+
+            case_reuse = False
             if self.config.template_construction:
-                sql_query, retrieved_cases = self.formulate_sql_template(query, masked_query, extracted_entities)
+                retrieved_cases = await self.aretrieve_cases(masked_query)
+
+                sql_query = self.reuse_case_sql(extracted_entities, retrieved_cases)
+                case_reuse = sql_query is not None
+                if not case_reuse:
+                    sql_query, retrieved_cases = await self.aformulate_sql_template(
+                        query, masked_query, extracted_entities, retrieved_cases, schema_matches,
+                    )
             else:
-                sql_query, retrieved_cases = self.formulate_sql_query(query)
+                sql_query, retrieved_cases = await self.aformulate_sql_query(query)
 
-            if self.config.source_discovery:
-                sql_query, relevant_entity_match = self.discover_sources(query, sql_query, extracted_entities)
+            if matching is not None:
+                sql_query, relevant_entity_match = await self.adiscover_sources(
+                    query, sql_query, extracted_entities, await matching,
+                )
             else:
                 relevant_entity_match = []
 
-            try:
-                sql_response = self.sql_db.run(sql_query)
-            except: 
-                sql_response = "DATA FAILED"
-
-            messages = [
-                ("system", prompt_factory.question_answering),
-                ("human", f"Question: {query}"),
-                ("human", f"Retrieved Data: {sql_response}"),
-                ("human", f"Answer:"),
-            ]
-            response = self.generator.generate(messages) if self.config.return_response else None
-        
-        return {
+            sql_query, execution, plan_check = await asyncio.to_thread(self.check_and_execute, query, sql_query)
+            sql_response = execution.response
+            response = await self.generator.agenerate(self.get_answer_messages(query, sql_response)) if self.config.return_response else None
+
+        result = {
             "response": response,
             "sql_query": sql_query,
             "sql_response": sql_response,
+            "execution": execution.to_dict(),
+            "plan_check": plan_check,
             "retrieved_cases": retrieved_cases,
             "relevant_entities": relevant_entity_match,
-            "token_usage": {
-                "total_tokens": cb.total_tokens,
-                "prompt_tokens": cb.prompt_tokens,
-                "completion_tokens": cb.completion_tokens,
-                "successful_requests": cb.successful_requests,
-            }
+            "case_reuse": case_reuse,
+            "source_discovery": get_discovery_path(relevant_entity_match),
+            "answer_cache": None,
         }
-    
+        await asyncio.to_thread(self.store_answer, answer_key, result)
+        return {**result, "token_usage": get_token_usage(cb)}
+
     def retain(self, query: str, correct_sql: str) -> bool:
         """
         Construct a masked case, and retain it.
@@ -157,16 +590,52 @@ class CBR2SQL(RAG2SQL):
         """
         Mask entities out of the query, and return the extracted entities.
         """
-        # Bind function calling to LLM
-        llm_extraction = self.generator.client.bind_tools([MaskingResults], strict=True)
+        masking = self.extract_entities(query)
+        if masking is not None:
+            return masking
+
+        # Extract entities from the query with function calling
+        response = self.generator.generate(
+            self.get_masking_messages(query), return_content=False, tools=[MaskingResults],
+        )
+        return self.parse_masking_response(query, response)
+
+    async def aget_masked_question(self, query: str) -> Tuple[str, List[Dict]]:
+        masking = self.extract_entities(query)
+        if masking is not None:
+            return masking
+
+        response = await self.generator.agenerate(
+            self.get_masking_messages(query), return_content=False, tools=[MaskingResults],
+        )
+        return self.parse_masking_response(query, response)
+
+    def extract_entities(self, query: str) -> Optional[Tuple[str, List[Dict]]]:
+        """
+        Mask with the local gazetteer. Returns None when there is no gazetteer, or when the
+        LLM fallback is enabled and the gazetteer found too few entities or left digits
+        (times, codes, numbers) that only the LLM masks. Query and retain both mask here,
+        so a question and its stored case are masked the same way.
+        """
+        if self.entity_extractor is None:
+            return None
 
-        # Extract entities from the query
-        messages = [
+        masking = self.entity_extractor.extract(query)
+        if self.config.gazetteer_fallback and (
+            len(masking.redacted_entities) < self.config.gazetteer_min_entities
+            or self.entity_extractor.has_unmasked_values(masking.masked_sentence)
+        ):
+            return None
+
+        return masking.masked_sentence, [entity.model_dump() for entity in masking.redacted_entities]
+
+    def get_masking_messages(self, query: str) -> List[Tuple[str]]:
+        return [
             ("system", prompt_factory.entity_extraction),
             ("human", query),
         ]
-        response = llm_extraction.invoke(messages)  
 
+    def parse_masking_response(self, query: str, response) -> Tuple[str, List[Dict]]:
         if "tool_calls" in response.additional_kwargs:
             tool_call_results = json.loads(response.additional_kwargs['tool_calls'][0]["function"]["arguments"])
             extracted_entities = tool_call_results["redacted_entities"]
@@ -179,66 +648,157 @@ class CBR2SQL(RAG2SQL):
         return masked_text, extracted_entities
 
     def formulate_sql_template(
-        self, 
-        query: str, 
+        self,
+        query: str,
         masked_query: str,
         extracted_entities: List[Dict],
+        retrieved_cases: List = None,
+        relevant_entity_match: List[Dict] = (),
     ) -> Tuple[str, List[Dict]]:
         """
         Write a SQL template based on similar past cases.
         """
         # Retrieve solution template
-        retrieved_cases = self.retriever.retrieve(masked_query, top_k=self.config.top_k) 
+        if retrieved_cases is None:
+            retrieved_cases = self.retrieve_cases(masked_query)
 
-        if self.config.brittle_retrieval:
-            retrieved_cases = drop_cases(retrieved_cases)
+        # Construct solution template based on examples
+        messages = self.get_template_messages(query, extracted_entities, retrieved_cases, relevant_entity_match)
+        response = self.generator.generate(messages, return_content=False)
+        sql_template = response.content
+        return remove_sql_wrapper(sql_template), retrieved_cases
 
+    async def aformulate_sql_template(
+        self,
+        query: str,
+        masked_query: str,
+        extracted_entities: List[Dict],
+        retrieved_cases: List = None,
+        relevant_entity_match: List[Dict] = (),
+    ) -> Tuple[str, List[Dict]]:
+        if retrieved_cases is None:
+            retrieved_cases = await self.aretrieve_cases(masked_query)
+
+        messages = self.get_template_messages(query, extracted_entities, retrieved_cases, relevant_entity_match)
+        sql_template = await self.generator.agenerate(messages)
+        return remove_sql_wrapper(sql_template), retrieved_cases
+
+    def reuse_case_sql(self, extracted_entities: List[Dict], retrieved_cases: List) -> Optional[str]:
+        """
+        Reuse the SQL of the top retrieved case as the template when it is similar enough
+        and masks the same entity labels, swapping its entity values for the new ones.
+        Returns None when the fast path does not apply.
+        """
+        threshold = self.config.case_reuse_threshold
+        if threshold is None or not retrieved_cases:
+            return None
+
+        case = retrieved_cases[0]
+        if case.metadata.get("similarity", 0.) < threshold:
+            return None
+
+        case_entities = case.metadata.get("related_entities", [])
+        if sorted(entity["label"] for entity in case_entities) != sorted(entity["label"] for entity in extracted_entities):
+            return None
+
+        # Pair entities of the same label in order of appearance
+        replacements = []
+        for label in {entity["label"] for entity in extracted_entities}:
+            replacements.extend(zip(
+                [entity["value"] for entity in case_entities if entity["label"] == label],
+                [entity["value"] for entity in extracted_entities if entity["label"] == label],
+            ))
+
+        return swap_values(case.metadata["sql_query"], replacements)
+
+    def get_template_messages(
+        self,
+        query: str,
+        extracted_entities: List[Dict],
+        retrieved_cases: List,
+        relevant_entity_match: List[Dict] = (),
+    ) -> List[Tuple[str]]:
         formatted_string = "\n\n-----\n\n".join(
             f"Query: {doc.metadata['case']}\nSQL Query: {doc.metadata['sql_query']}" for doc in retrieved_cases
         )
-        
-        masking_entities = [entity for entity in extracted_entities if entity["label"] in [
-            "CONDITION", "PROCEDURE", "ETHNICITY",
-            "DRUG", "NAME", "RELIGION", "EQUIPMENT",
-        ]]
 
-        # Construct solution template based on examples
-        messages = [
+        masking_entities = [entity for entity in extracted_entities if entity["label"] in MASKED_LABELS]
+
+        return [
             ("system", prompt_factory.template_formulation),
-            ("system", f"Schema Information:{self.sql_db.get_table_info()}"),
+            ("system", f"Schema Information:{self.get_table_info(retrieved_cases, relevant_entity_match)}"),
             ("human", f"Entities to highlight: {masking_entities}"),
             ("human", f"User Question: {query}"),
             ("human", f"Past SQL Examples: {formatted_string}"),
             ("human", f"Revised SQL Query:"),
         ]
-        response = self.generator.generate(messages, return_content=False) 
-        sql_template = response.content
-        return remove_sql_wrapper(sql_template), retrieved_cases
 
     def discover_sources(
-        self, 
-        query: str, 
-        sql_template: str, 
-        extracted_entities: List[Dict]
+        self,
+        query: str,
+        sql_template: str,
+        extracted_entities: List[Dict],
+        relevant_entity_match: List[Dict] = None,
     ) -> Tuple[str, List[Dict]]:
         """
         Modify templates to adapt to true sources of the entities.
+        Unambiguous matches are substituted directly; the LLM only sees the remainder.
         """
         # Extract relevant entities
-        # To-do: Re-rank matches using Levenshtein distance
-        relevant_entity_match = []
-        
-        for entity in extracted_entities:
-            if entity["label"] in [
-                "CONDITION", "PROCEDURE", "ETHNICITY",
-                "DRUG", "NAME", "RELIGION", "EQUIPMENT",
-            ]:
-                relevant_matches = self.lookup(entity["value"])
-                relevant_entity_match.append({
-                    "entity": entity["value"],
-                    "matches": relevant_matches,
-                })
+        if relevant_entity_match is None:
+            relevant_entity_match = self.match_entities(extracted_entities)
+
+        sql_template, unresolved = self.substitute_sources(sql_template, relevant_entity_match)
+
+        # Revise solution based on examples
+        if unresolved:
+            messages = self.get_source_discovery_messages(query, sql_template, unresolved)
+            sql_query = self.generator.generate(messages)
+
+        else:
+            sql_query = sql_template
+
+        return remove_sql_wrapper(sql_query), relevant_entity_match
+
+    async def adiscover_sources(
+        self,
+        query: str,
+        sql_template: str,
+        extracted_entities: List[Dict],
+        relevant_entity_match: List[Dict] = None,
+    ) -> Tuple[str, List[Dict]]:
+        if relevant_entity_match is None:
+            relevant_entity_match = await self.amatch_entities(extracted_entities)
 
+        sql_template, unresolved = self.substitute_sources(sql_template, relevant_entity_match)
+
+        if unresolved:
+            messages = self.get_source_discovery_messages(query, sql_template, unresolved)
+            sql_query = await self.generator.agenerate(messages)
+
+        else:
+            sql_query = sql_template
+
+        return remove_sql_wrapper(sql_query), relevant_entity_match
+
+    def substitute_sources(self, sql_template: str, relevant_entity_match: List[Dict]) -> Tuple[str, List[Dict]]:
+        if self.config.rule_based_discovery:
+            sql_template, unresolved = substitute_sources(
+                sql_template, relevant_entity_match, self.config.substitution_threshold,
+            )
+        else:
+            unresolved = [entity_match for entity_match in relevant_entity_match if entity_match["matches"]]
+
+        for entity_match in unresolved:
+            entity_match["resolved_by"] = "llm"
+        return sql_template, unresolved
+
+    def get_source_discovery_messages(
+        self,
+        query: str,
+        sql_template: str,
+        relevant_entity_match: List[Dict],
+    ) -> List[Tuple[str]]:
         formatted_string = "\n-----\n".join(
             f"Relevant matches for entity: `{doc['entity']}`\n" + "\n".join([
                 f"Relevant match #{idx}: `{match['page_content']}`, Table: `{match['metadata']['table']}`, Column: `{match['metadata']['column']}`" \
@@ -246,39 +806,176 @@ class CBR2SQL(RAG2SQL):
             ]) for doc in relevant_entity_match
         )
 
-        # Revise solution based on examples
-        if relevant_entity_match:
-            messages = [
-                ("system", prompt_factory.source_discovery),
-                ("human", f"User Question: {query}"),
-                ("human", f"Initial SQL Template: {sql_template}"),
-                ("human", f"Relevant entity matches: {formatted_string}"),
-                ("human", f"Revised SQL Query:"),
-            ]
-            sql_query = self.generator.generate(messages) 
-            
-        else:
-            sql_query = sql_template
+        return [
+            ("system", prompt_factory.source_discovery),
+            ("human", f"User Question: {query}"),
+            ("human", f"Initial SQL Template: {sql_template}"),
+            ("human", f"Relevant entity matches: {formatted_string}"),
+            ("human", f"Revised SQL Query:"),
+        ]
 
-        return remove_sql_wrapper(sql_query), relevant_entity_match
-    
-    def lookup(self, query: str, retrieval_range: int = 100, top_k: int = 5) -> List[Dict]:
+    def match_entities(self, extracted_entities: List[Dict]) -> List[Dict]:
+        """
+        Look up the real database values for every maskable entity, in one batch.
+        """
+        extracted_entities = [entity for entity in extracted_entities if entity["label"] in MASKED_LABELS]
+        entities = [entity["value"] for entity in extracted_entities]
+        matches = self.lookup_many(entities, labels=[entity["label"] for entity in extracted_entities])
+        return [
+            {
+                "entity": entity,
+                "matches": relevant_matches,
+            }
+            for entity, relevant_matches in zip(entities, matches)
+        ]
+
+    async def amatch_entities(self, extracted_entities: List[Dict]) -> List[Dict]:
+        return await asyncio.to_thread(self.match_entities, extracted_entities)
+
+    def lookup(self, query: str, retrieval_range: int = 100, top_k: int = 5, label: str = None) -> List[Dict]:
         """
         Retrieve similar (real) entities given a seed value
         Retrieve with cosine similarity, re-rank using Levenshtein distance
+        Values found in the exact-match index are returned without retrieval
+        With `label`, only the columns mapped to it are searched (if label filtering is on)
         """
-        matches = self.lookup_table.retrieve(query, top_k=retrieval_range)
-        reranked_results = []
+        return self.lookup_many([query], retrieval_range, top_k, [label])[0]
 
-        for match in matches:
-            match_dict = match.model_dump()
-            reranked_results.append({
-                **match_dict,
-                "score": nltk.edit_distance(
-                    " ".join(sorted(tokenize(query))), 
-                    " ".join(sorted(tokenize(match_dict["page_content"])))
-                )
-            })
+    async def alookup(self, query: str, retrieval_range: int = 100, top_k: int = 5, label: str = None) -> List[Dict]:
+        return await asyncio.to_thread(self.lookup, query, retrieval_range, top_k, label)
+
+    def lookup_many(
+        self,
+        queries: List[str],
+        retrieval_range: int = 100,
+        top_k: int = 5,
+        labels: List[str] = None,
+    ) -> List[List[Dict]]:
+        """
+        `lookup` for several values: one batch embedding and one batched vector search for all
+        values missing from the exact-match index, then one re-ranking of all their candidates.
+        """
+        sources = [self.get_entity_sources(label) for label in (labels or [None] * len(queries))]
+        exact_matches = [
+            self.get_exact_matches(query, top_k, query_sources) for query, query_sources in zip(queries, sources)
+        ]
+        pending = [idx for idx, matches in enumerate(exact_matches) if matches is None]
+        candidates = self.retrieve_candidates(
+            [queries[idx] for idx in pending], retrieval_range, [sources[idx] for idx in pending],
+        )
+        return self.merge_matches(queries, exact_matches, candidates, top_k)
+
+    async def alookup_many(
+        self,
+        queries: List[str],
+        retrieval_range: int = 100,
+        top_k: int = 5,
+        labels: List[str] = None,
+    ) -> List[List[Dict]]:
+        return await asyncio.to_thread(self.lookup_many, queries, retrieval_range, top_k, labels)
+
+    def get_entity_sources(self, label: str = None) -> Optional[List[Tuple[str, str]]]:
+        """
+        The (table, column) pairs to search for an entity label; None searches everything.
+        """
+        if not self.config.label_filtering or label is None:
+            return None
+        return self.label_sources.get(label)
+
+    def retrieve_candidates(
+        self,
+        queries: List[str],
+        top_k: int = 100,
+        sources: List[Optional[List[Tuple[str, str]]]] = None,
+    ) -> List[List[Document]]:
+        """
+        Lookup candidates of every query from the configured engine: vector search (one batch),
+        the trigram index, or both.
+        """
+        if not queries:
+            return []
+
+        sources = sources or [None] * len(queries)
+        if self.config.lookup_engine != "trigram":
+            dense = self.lookup_table.retrieve_many(
+                queries,
+                top_k=top_k,
+                filters=[self.lookup_table.get_source_filter(query_sources) if query_sources else None for query_sources in sources],
+            )
+        else:
+            dense = [[] for _ in queries]
+
+        return [
+            self.merge_candidates(query_dense, self.search_trigrams(query, top_k, query_sources))
+            for query, query_dense, query_sources in zip(queries, dense, sources)
+        ]
+
+    def search_trigrams(self, query: str, top_k: int = 100, sources: List[Tuple[str, str]] = None) -> List[Document]:
+        if self.config.lookup_engine == "dense":
+            return []
+        return self.trigram_index.search(query, top_k, self.config.lookup_max_distance, sources)
+
+    @staticmethod
+    def merge_candidates(*candidate_lists: List[Document]) -> List[Document]:
+        merged = {}
+        for candidates in candidate_lists:
+            for candidate in candidates:
+                key = (candidate.page_content, candidate.metadata.get("table"), candidate.metadata.get("column"))
+                merged.setdefault(key, candidate)
+        return list(merged.values())
+
+    def get_exact_matches(self, query: str, top_k: int = 5, sources: List[Tuple[str, str]] = None) -> Optional[List[Dict]]:
+        """
+        Matches of a value present as-is (up to case and whitespace) in the exact-match index,
+        in the format of `rerank_matches`. None when there is no index or no hit.
+        """
+        if self.exact_index is None:
+            return None
+
+        hits = [hit for hit in self.exact_index.get(query) if sources is None or hit[:2] in sources]
+        if not hits:
+            return None
+
+        return [
+            {
+                **Document(
+                    page_content=value,
+                    metadata={"table": table, "column": column, "lookup_key": lookup_key(value)},
+                ).model_dump(),
+                "score": 0,
+            } for table, column, value in hits[:top_k]
+        ]
+
+    def merge_matches(
+        self,
+        queries: List[str],
+        exact_matches: List[Optional[List[Dict]]],
+        candidates: List[List],
+        top_k: int = 5,
+    ) -> List[List[Dict]]:
+        """
+        Exact matches where available, re-ranked candidates for the other queries
+        (`candidates` holds the retrievals of those queries only, in order).
+        """
+        pending = [query for query, matches in zip(queries, exact_matches) if matches is None]
+        reranked = iter(self.rerank_matches(pending, candidates, top_k) if pending else [])
+        return [matches if matches is not None else next(reranked) for matches in exact_matches]
 
-        reranked_results = sorted(reranked_results, key=lambda x: x["score"])[:top_k]
+    def rerank_matches(self, queries: List[str], matches: List[List], top_k: int = 5) -> List[List[Dict]]:
+        """
+        Re-rank the candidates of every query by the edit distance between token-sorted keys,
+        all queries in one vectorized call. Keys precomputed at ingest (`lookup_key`) are reused.
+        """
+        keys = [
+            [match.metadata.get("lookup_key") or lookup_key(match.page_content) for match in candidates]
+            for candidates in matches
+        ]
+        distances = edit_distances([lookup_key(query) for query in queries], keys, top_k)
+
+        reranked_results = []
+        for candidates, scores in zip(matches, distances):
+            order = np.argsort(scores, kind="stable")[:top_k]
+            reranked_results.append([
+                {**candidates[idx].model_dump(), "score": int(scores[idx])} for idx in order
+            ])
         return reranked_results
@@ -0,0 +1,76 @@
+import numpy as np
+from typing import List
+
+
+PRUNED = np.iinfo(np.int32).max
+
+
+def encode_strings(texts: List[str], pad: int) -> np.ndarray:
+    lengths = [len(text) for text in texts]
+    codes = np.full((len(texts), max(lengths, default=0)), pad, dtype=np.int32)
+    for idx, text in enumerate(texts):
+        codes[idx, :len(text)] = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    return codes
+
+
+def edit_distances(queries: List[str], candidates: List[List[str]], top_k: int = None) -> List[np.ndarray]:
+    """
+    Levenshtein distance of every query to each of its own candidates.
+
+    All (query, candidate) pairs of all queries go through one NumPy dynamic program that
+    advances one query character per step: the diagonal/deletion moves are vectorized over
+    the row, the insertion chain is a running minimum. With `top_k`, a pair is abandoned as
+    soon as its row minimum (a lower bound of its distance) exceeds the current k-th best
+    upper bound of its query, and gets the distance `PRUNED`. The top-k distances are exact.
+    """
+    sizes = [len(group) for group in candidates]
+    offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(int)
+    groups = np.repeat(np.arange(len(queries)), sizes)
+
+    sources = encode_strings([queries[group] for group in groups], pad=-1)
+    targets = encode_strings([text for group in candidates for text in group], pad=-2)
+    source_lengths = np.array([len(queries[group]) for group in groups], dtype=np.int32)
+    target_lengths = np.array([len(text) for group in candidates for text in group], dtype=np.int32)
+
+    distances = np.full(len(groups), PRUNED, dtype=np.int32)
+    upper_bounds = np.maximum(source_lengths, target_lengths)
+
+    def get_thresholds():
+        thresholds = np.full(len(queries), PRUNED, dtype=np.int32)
+        if top_k is not None:
+            for group, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+                if end - start > top_k:
+                    thresholds[group] = np.partition(upper_bounds[start:end], top_k - 1)[top_k - 1]
+        return thresholds
+
+    thresholds = get_thresholds()
+
+    empty = source_lengths == 0
+    distances[empty] = target_lengths[empty]
+
+    active = np.flatnonzero(~empty & (np.abs(source_lengths - target_lengths) <= thresholds[groups]))
+    columns = np.arange(targets.shape[1] + 1, dtype=np.int32)
+    previous = np.tile(columns, (len(active), 1))
+
+    for row in range(1, sources.shape[1] + 1):
+        if len(active) == 0:
+            break
+
+        cost = (sources[active, row - 1][:, None] != targets[active]).astype(np.int32)
+        current = np.empty_like(previous)
+        current[:, 0] = row
+        current[:, 1:] = np.minimum(previous[:, :-1] + cost, previous[:, 1:] + 1)
+        current = np.minimum.accumulate(current - columns, axis=1) + columns
+
+        finished = source_lengths[active] == row
+        if finished.any():
+            done = active[finished]
+            distances[done] = current[finished, target_lengths[done]]
+            upper_bounds[done] = distances[done]
+            thresholds = get_thresholds()
+
+        lower_bounds = np.where(columns <= target_lengths[active][:, None], current, PRUNED).min(axis=1)
+        keep = ~finished & (lower_bounds <= thresholds[groups[active]])
+        active, previous = active[keep], current[keep]
+
+    return [distances[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
@@ -1,17 +1,66 @@
-from typing import List, Dict
+import os
+import json
+import time
+import uuid
+import asyncio
+import functools
+import threading
+import numpy as np
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Dict, Iterable, Tuple, Optional
+
+from tqdm import tqdm
 
 from qdrant_client import QdrantClient, models
 
 from langchain.schema.document import Document
 from langchain_qdrant import QdrantVectorStore, RetrievalMode
-from langchain_community.embeddings import HuggingFaceEmbeddings
 
 from configs import RetrieverConfig
+from embeddings import get_embedder
 
 from dotenv import load_dotenv
 load_dotenv()
 
 
+# Number of set bits of every byte value
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+# Embedded Qdrant clients by storage path; a path can only be opened once per process
+_local_clients: Dict[str, "SynchronizedClient"] = {}
+_local_clients_lock = threading.Lock()
+
+
+class SynchronizedClient:
+    """
+    Wraps an embedded QdrantClient, which is not thread-safe, so that its method calls
+    are serialized. Ingest workers and pipeline threads share one client per path.
+    """
+    def __init__(self, client: QdrantClient):
+        self._client = client
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def synchronized(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+        return synchronized
+
+
+def get_local_client(path: str) -> SynchronizedClient:
+    with _local_clients_lock:
+        if path not in _local_clients:
+            client = QdrantClient(location=":memory:") if path == ":memory:" else QdrantClient(path=path)
+            _local_clients[path] = SynchronizedClient(client)
+        return _local_clients[path]
+
+
 class BaseRetriever:
     def __init__(
         self, 
@@ -21,33 +70,126 @@ class BaseRetriever:
         self.config = config
         self.collection_name = collection_name
 
-        self.embedder = HuggingFaceEmbeddings(
-            model_name=self.config.embedding_model,
-            model_kwargs={"device": self.config.device},
+        if self.config.quantization not in (None, "scalar", "binary"):
+            raise ValueError(f"Unknown quantization: {self.config.quantization}")
+
+        self.embedder = get_embedder(
+            self.config.embedding_model,
+            self.config.device,
+            self.config.embedding_cache_dir,
         )
 
     def retrieve(self, query: str, top_k: int):
+        """
+        Return the `top_k` most similar documents, with their similarity in `metadata["similarity"]`.
+        """
         raise NotImplementedError()
 
-    def ingest(self, documents: List[Dict]):
+    async def aretrieve(self, query: str, top_k: int, **kwargs):
+        return await asyncio.to_thread(self.retrieve, query, top_k, **kwargs)
+
+    def retrieve_many(self, queries: List[str], top_k: int, filters: List = None, **kwargs) -> List[List[Document]]:
+        """
+        `retrieve` for every query; `filters` optionally gives each query its own filter.
+        """
+        if filters is None:
+            return [self.retrieve(query, top_k, **kwargs) for query in queries]
+        return [self.retrieve(query, top_k, filter=filter, **kwargs) for query, filter in zip(queries, filters)]
+
+    def ingest(self, documents: List[Dict], index_field: str):
+        raise NotImplementedError()
+
+    def bulk_ingest(
+        self,
+        documents: Iterable[Dict],
+        index_field: str,
+        batch_size: int = None,
+        show_progress: bool = True,
+        **kwargs,
+    ) -> Dict:
+        """
+        Stream `documents` through `ingest` in batches. Returns counts and throughput.
+        """
+        batch_size = batch_size or self.config.ingest_batch_size
+        documents = iter(documents)
+
+        stats = {"documents": 0}
+        start = time.perf_counter()
+        progress = tqdm(desc=f"Ingest {self.collection_name}", unit="doc", disable=not show_progress)
+        while True:
+            batch = list(islice(documents, batch_size))
+            if not batch:
+                break
+            self.ingest(batch, index_field)
+            stats["documents"] += len(batch)
+            progress.update(len(batch))
+        progress.close()
+
+        stats["seconds"] = time.perf_counter() - start
+        stats["docs_per_second"] = stats["documents"] / stats["seconds"] if stats["seconds"] else 0.
+        return stats
+
+    def delete(self, node_ids: List):
         raise NotImplementedError()
 
     def reset(self):
         raise NotImplementedError()
 
+    def get_source_filter(self, sources: List[Tuple[str, str]]):
+        """
+        Backend filter restricting a search to documents of the given (table, column) pairs.
+        """
+        raise NotImplementedError()
+
+    def create_payload_index(self, field: str):
+        """
+        Index a metadata field for filtered search, where the backend supports it.
+        """
+        pass
+
+    @staticmethod
+    def get_document_id(page_content: str, metadata: Dict) -> str:
+        """
+        Deterministic point ID derived from the document content, so re-ingesting it is a no-op.
+        """
+        content = json.dumps([page_content, metadata], sort_keys=True, default=str)
+        return str(uuid.uuid5(uuid.NAMESPACE_OID, content))
+
+    @staticmethod
+    def to_payload(document: Dict, index_field: str) -> Dict:
+        page_content = document[index_field]
+        metadata = {key: value for key, value in document.items() if key != index_field}
+        return {
+            "id": BaseRetriever.get_document_id(page_content, metadata),
+            "page_content": page_content,
+            "metadata": metadata,
+        }
+
 
 class QdrantRetriever(BaseRetriever):
+    """
+    Collection of a Qdrant server at `base_url`, or of an embedded Qdrant when
+    `config.qdrant_path` is set. With `snapshot_path`, an empty collection is filled
+    from that file (see `export_snapshot`) at startup.
+    """
     def __init__(
         self, 
         collection_name: str = "main",
         config: RetrieverConfig = RetrieverConfig.default(), 
         base_url: str = "http://localhost:6333",
+        snapshot_path: str = None,
     ):
         super().__init__(collection_name, config)
 
-        self.client = QdrantClient(url=base_url)
+        if self.config.qdrant_path is None:
+            self.client = QdrantClient(url=base_url, prefer_grpc=self.config.prefer_grpc)
+        else:
+            self.client = get_local_client(self.config.qdrant_path)
         self._ensure_collection_exists()
 
+        if snapshot_path is not None and self.client.count(collection_name=self.collection_name).count == 0:
+            self.import_snapshot(snapshot_path)
+
         self.vectorstore = QdrantVectorStore(
             client=self.client, 
             collection_name=self.collection_name,
@@ -63,18 +205,120 @@ class QdrantRetriever(BaseRetriever):
                 vectors_config=models.VectorParams(
                     size=self.config.embedding_dim, 
                     distance=models.Distance.COSINE,
+                    # Quantized codes stay in RAM; the originals are only read to rescore
+                    on_disk=self.config.on_disk_vectors if self.config.on_disk_vectors is not None
+                    else self.config.quantization is not None,
                 ),
+                hnsw_config=models.HnswConfigDiff(
+                    m=self.config.hnsw_m,
+                    ef_construct=self.config.hnsw_ef_construct,
+                ),
+                on_disk_payload=self.config.on_disk_payload,
+                quantization_config=self.get_quantization_config(),
             )
 
-    def ingest(self, documents: List[Dict], index_field: str):
-        documents_langchain = []
-        for doc in documents:
-            metadata = {key: value for key, value in doc.items() if key != index_field}
-            documents_langchain.append(Document(
-                page_content=doc[index_field], 
-                metadata=metadata,
+    def get_quantization_config(self) -> Optional[models.QuantizationConfig]:
+        if self.config.quantization == "scalar":
+            return models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8, quantile=0.99, always_ram=True,
             ))
-        self.vectorstore.add_documents(documents_langchain)
+        if self.config.quantization == "binary":
+            return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+        return None
+
+    @property
+    def search_params(self) -> Optional[models.SearchParams]:
+        if self.config.quantization is None and self.config.hnsw_ef is None:
+            return None
+        return models.SearchParams(
+            hnsw_ef=self.config.hnsw_ef,
+            quantization=models.QuantizationSearchParams(
+                rescore=self.config.quantization_rescore,
+                oversampling=self.config.quantization_oversampling,
+            ) if self.config.quantization is not None else None,
+        )
+
+    def ingest(self, documents: List[Dict], index_field: str):
+        self.bulk_ingest(documents, index_field, show_progress=False)
+
+    def bulk_ingest(
+        self,
+        documents: Iterable[Dict],
+        index_field: str,
+        batch_size: int = None,
+        max_workers: int = None,
+        show_progress: bool = True,
+    ) -> Dict:
+        """
+        Stream `documents` into the collection in batches.
+
+        Points get content-derived IDs: documents already stored are skipped before embedding,
+        so re-ingesting is a no-op. Embedding runs in the calling thread while up to
+        `max_workers` batches are upserted concurrently. Returns counts and throughput.
+        """
+        batch_size = batch_size or self.config.ingest_batch_size
+        max_workers = max_workers or self.config.ingest_workers
+        documents = iter(documents)
+
+        stats = {"documents": 0, "ingested": 0, "skipped": 0}
+        start = time.perf_counter()
+        progress = tqdm(desc=f"Ingest {self.collection_name}", unit="doc", disable=not show_progress)
+
+        def upsert(points: List[models.PointStruct]):
+            self.client.upsert(collection_name=self.collection_name, points=points, wait=True)
+            return len(points)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = set()
+            while True:
+                batch = list(islice(documents, batch_size))
+                if not batch:
+                    break
+
+                payloads = list({
+                    payload["id"]: payload for payload in (self.to_payload(doc, index_field) for doc in batch)
+                }.values())
+                existing = {
+                    point.id for point in self.client.retrieve(
+                        collection_name=self.collection_name,
+                        ids=[payload["id"] for payload in payloads],
+                        with_payload=False,
+                        with_vectors=False,
+                    )
+                }
+                payloads = [payload for payload in payloads if payload["id"] not in existing]
+
+                stats["documents"] += len(batch)
+                stats["skipped"] += len(batch) - len(payloads)
+                progress.update(len(batch) - len(payloads))
+
+                if payloads:
+                    vectors = self.embedder.embed_documents([payload["page_content"] for payload in payloads])
+                    points = [
+                        models.PointStruct(
+                            id=payload["id"],
+                            vector=vector,
+                            payload={"page_content": payload["page_content"], "metadata": payload["metadata"]},
+                        ) for payload, vector in zip(payloads, vectors)
+                    ]
+                    # Bound the number of embedded batches waiting for upload
+                    if len(pending) >= max_workers:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            stats["ingested"] += future.result()
+                            progress.update(future.result())
+                    pending.add(executor.submit(upsert, points))
+
+                progress.set_postfix(docs_per_s=f"{progress.n / (time.perf_counter() - start):.0f}")
+
+            for future in pending:
+                stats["ingested"] += future.result()
+                progress.update(future.result())
+        progress.close()
+
+        stats["seconds"] = time.perf_counter() - start
+        stats["docs_per_second"] = stats["documents"] / stats["seconds"] if stats["seconds"] else 0.
+        return stats
     
     def delete(self, node_ids: List):
         self.vectorstore.delete(node_ids)
@@ -83,6 +327,70 @@ class QdrantRetriever(BaseRetriever):
         self.client.delete_collection(collection_name=self.collection_name)
         self._ensure_collection_exists()
 
+    def export_snapshot(self, path: str, batch_size: int = 1000):
+        """
+        Write every point (ID, vector, payload) of the collection to a portable `.npz` file,
+        loadable by `import_snapshot` into a server or an embedded Qdrant.
+        """
+        ids, vectors, payloads = [], [], []
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            for point in points:
+                ids.append(point.id)
+                vectors.append(point.vector)
+                payloads.append(point.payload)
+            if offset is None:
+                break
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(
+            path,
+            vectors=np.asarray(vectors, dtype=np.float32).reshape(len(vectors), self.config.embedding_dim),
+            points=np.array(json.dumps({"ids": ids, "payloads": payloads})),
+        )
+
+    def import_snapshot(self, path: str, batch_size: int = 1000):
+        with np.load(path) as snapshot:
+            vectors = snapshot["vectors"]
+            points = json.loads(str(snapshot["points"]))
+
+        for start in range(0, len(vectors), batch_size):
+            self.client.upsert(
+                collection_name=self.collection_name,
+                points=[
+                    models.PointStruct(id=point_id, vector=vector.tolist(), payload=payload)
+                    for point_id, vector, payload in zip(
+                        points["ids"][start:start + batch_size],
+                        vectors[start:start + batch_size],
+                        points["payloads"][start:start + batch_size],
+                    )
+                ],
+                wait=True,
+            )
+
+    def get_source_filter(self, sources: List[Tuple[str, str]]) -> models.Filter:
+        return models.Filter(should=[
+            models.Filter(must=[
+                models.FieldCondition(key="metadata.table", match=models.MatchValue(value=table)),
+                models.FieldCondition(key="metadata.column", match=models.MatchValue(value=column)),
+            ]) for table, column in sources
+        ])
+
+    def create_payload_index(self, field: str):
+        self.client.create_payload_index(
+            collection_name=self.collection_name,
+            field_name=f"metadata.{field}",
+            field_schema=models.PayloadSchemaType.KEYWORD,
+        )
+
     def retrieve(
         self, 
         query: str, 
@@ -90,10 +398,327 @@ class QdrantRetriever(BaseRetriever):
         filter: models.Filter = None,
         score_threshold: float = None,
     ):
-        retrieve_documents = self.vectorstore.similarity_search(
+        retrieve_documents = self.vectorstore.similarity_search_with_score(
             query=query, 
             k=top_k, 
             filter=filter,
+            search_params=self.search_params,
             score_threshold=score_threshold,
         )
-        return retrieve_documents
\ No newline at end of file
+        for document, score in retrieve_documents:
+            document.metadata["similarity"] = score
+        return [document for document, _ in retrieve_documents]
+
+    def retrieve_many(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        filter: models.Filter = None,
+        score_threshold: float = None,
+        filters: List[models.Filter] = None,
+    ) -> List[List[Document]]:
+        """
+        Embed all queries in one batch and send them as a single batched search.
+        `filters` optionally gives each query its own filter instead of the shared `filter`.
+        """
+        if not queries:
+            return []
+        filters = filters if filters is not None else [filter] * len(queries)
+
+        query_vectors = self.embedder.embed_documents(queries)
+        responses = self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=[
+                models.QueryRequest(
+                    query=vector,
+                    limit=top_k,
+                    filter=query_filter,
+                    params=self.search_params,
+                    score_threshold=score_threshold,
+                    with_payload=True,
+                ) for vector, query_filter in zip(query_vectors, filters)
+            ],
+        )
+        return [[self._to_document(point) for point in response.points] for response in responses]
+
+    def _to_document(self, point: models.ScoredPoint) -> Document:
+        payload = point.payload or {}
+        metadata = dict(payload.get("metadata") or {})
+        metadata["_id"] = point.id
+        metadata["_collection_name"] = self.collection_name
+        metadata["similarity"] = point.score
+        return Document(page_content=payload.get("page_content", ""), metadata=metadata)
+
+
+class NumpyRetriever(BaseRetriever):
+    """
+    Embedded flat index: L2-normalized embeddings in a (memory-mapped) matrix, payloads alongside.
+    Search is one matrix product plus `argpartition`. With `path`, the collection is stored in
+    `{path}/{collection_name}/` and memory-mapped on load; without it, it lives in memory only.
+
+    With quantization, a scalar (int8, per-dimension scale) or binary (sign bit) copy of the
+    matrix is held in RAM and scanned instead; the best candidates are then rescored on the
+    original vectors, which stay memory-mapped on disk.
+    """
+    chunk_size = 16384
+
+    def __init__(
+        self, 
+        collection_name: str = "main",
+        config: RetrieverConfig = RetrieverConfig.default(), 
+        path: str = None,
+    ):
+        super().__init__(collection_name, config)
+
+        self.dtype = np.dtype(self.config.vector_dtype)
+        self.directory = os.path.join(path, collection_name) if path else None
+
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        self._vectors = np.zeros((0, self.config.embedding_dim), dtype=self.dtype)
+        self._payloads = []
+        self._metadata_columns = {}
+        self._codes, self._scales = self._quantize(self._vectors)
+
+        if self.directory and os.path.exists(os.path.join(self.directory, "vectors.npy")):
+            self._vectors = np.load(os.path.join(self.directory, "vectors.npy"), mmap_mode="r")
+            with open(os.path.join(self.directory, "payloads.json"), "r") as f:
+                self._payloads = json.load(f)
+
+            quantized_path = os.path.join(self.directory, f"quantized_{self.config.quantization}.npz")
+            if self.config.quantization is not None and os.path.exists(quantized_path):
+                with np.load(quantized_path) as quantized:
+                    self._codes, self._scales = quantized["codes"], quantized["scales"]
+            else:
+                self._codes, self._scales = self._quantize(self._vectors)
+
+    def _save(self, vectors: np.ndarray, payloads: List[Dict]):
+        if self.directory is None:
+            self._vectors, self._payloads = vectors, payloads
+            self._codes, self._scales = self._quantize(vectors)
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            np.save(os.path.join(self.directory, "vectors.tmp.npy"), vectors)
+            with open(os.path.join(self.directory, "payloads.tmp.json"), "w") as f:
+                json.dump(payloads, f)
+            for quantization in ["scalar", "binary"]:
+                quantized_path = os.path.join(self.directory, f"quantized_{quantization}.npz")
+                if quantization == self.config.quantization:
+                    codes, scales = self._quantize(vectors)
+                    np.savez(os.path.join(self.directory, "quantized.tmp.npz"), codes=codes, scales=scales)
+                    os.replace(os.path.join(self.directory, "quantized.tmp.npz"), quantized_path)
+                elif os.path.exists(quantized_path):
+                    # Codes of another configuration would be stale after this write
+                    os.remove(quantized_path)
+            os.replace(os.path.join(self.directory, "vectors.tmp.npy"), os.path.join(self.directory, "vectors.npy"))
+            os.replace(os.path.join(self.directory, "payloads.tmp.json"), os.path.join(self.directory, "payloads.json"))
+            self._load()
+        self._metadata_columns = {}
+
+    def _quantize(self, vectors: np.ndarray) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """
+        Quantized codes of `vectors` and the per-dimension scales of scalar quantization.
+        """
+        if self.config.quantization == "scalar":
+            vectors = np.asarray(vectors, dtype=np.float32)
+            scales = np.quantile(np.abs(vectors), 0.99, axis=0) if len(vectors) else np.ones(vectors.shape[1])
+            scales = np.maximum(scales, 1e-12).astype(np.float32)
+            return np.clip(np.rint(vectors / scales * 127), -127, 127).astype(np.int8), scales
+        if self.config.quantization == "binary":
+            return np.packbits(np.asarray(vectors) > 0, axis=1), np.zeros(0, dtype=np.float32)
+        return None, None
+
+    def _score(self, query_vectors: np.ndarray) -> np.ndarray:
+        """
+        (queries, rows) similarities: exact on the stored vectors, or approximate on the quantized codes.
+        """
+        if self._codes is None:
+            return np.asarray(self._vectors @ query_vectors.T.astype(self.dtype), dtype=np.float32).T
+
+        scores = np.empty((len(query_vectors), len(self._codes)), dtype=np.float32)
+        if self.config.quantization == "scalar":
+            scaled_queries = (query_vectors * self._scales / 127).T
+        else:
+            query_bits = np.packbits(query_vectors > 0, axis=1)
+
+        for start in range(0, len(self._codes), self.chunk_size):
+            codes = self._codes[start:start + self.chunk_size]
+            if self.config.quantization == "scalar":
+                scores[:, start:start + len(codes)] = (codes.astype(np.float32) @ scaled_queries).T
+            else:
+                hamming = POPCOUNT[codes[None] ^ query_bits[:, None]].sum(axis=2, dtype=np.int32)
+                scores[:, start:start + len(codes)] = 1 - 2 * hamming / self.config.embedding_dim
+        return scores
+
+    def _rescore(self, scores: np.ndarray, query_vectors: np.ndarray, top_k: int) -> np.ndarray:
+        """
+        Exact similarities of the over-sampled best candidates of each query, -inf elsewhere.
+        """
+        n_candidates = min(scores.shape[1], int(np.ceil(top_k * self.config.quantization_oversampling)))
+        rescored = np.full_like(scores, -np.inf)
+        if n_candidates == 0:
+            return rescored
+
+        for row, (approximate, query_vector) in enumerate(zip(scores, query_vectors)):
+            candidates = np.argpartition(-approximate, n_candidates - 1)[:n_candidates]
+            candidates = np.sort(candidates[np.isfinite(approximate[candidates])])
+            rescored[row, candidates] = np.asarray(self._vectors[candidates], dtype=np.float32) @ query_vector
+        return rescored
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.asarray(self.embedder.embed_documents(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _embed_new(self, documents: List[Dict], index_field: str, existing: set) -> Tuple[np.ndarray, List[Dict]]:
+        """
+        Vectors and payloads of the documents whose ID is not in `existing` (which is updated).
+        """
+        payloads = list({
+            payload["id"]: payload for payload in (self.to_payload(doc, index_field) for doc in documents)
+        }.values())
+        payloads = [payload for payload in payloads if payload["id"] not in existing]
+        existing.update(payload["id"] for payload in payloads)
+        if not payloads:
+            return np.zeros((0, self.config.embedding_dim), dtype=self.dtype), []
+        return self._embed([payload["page_content"] for payload in payloads]).astype(self.dtype), payloads
+
+    def ingest(self, documents: List[Dict], index_field: str):
+        if not documents:
+            return
+
+        with self._lock:
+            existing = {payload["id"] for payload in self._payloads}
+        vectors, payloads = self._embed_new(documents, index_field, existing)
+        if not payloads:
+            return
+
+        with self._lock:
+            self._save(np.concatenate([self._vectors, vectors]), self._payloads + payloads)
+
+    def bulk_ingest(
+        self,
+        documents: Iterable[Dict],
+        index_field: str,
+        batch_size: int = None,
+        show_progress: bool = True,
+        **kwargs,
+    ) -> Dict:
+        """
+        Stream `documents` in batches, embedding only new IDs. The new rows are gathered in
+        memory and the collection is written once at the end, instead of once per batch.
+        """
+        batch_size = batch_size or self.config.ingest_batch_size
+        documents = iter(documents)
+
+        with self._lock:
+            existing = {payload["id"] for payload in self._payloads}
+
+        new_vectors, new_payloads = [], []
+        stats = {"documents": 0, "ingested": 0, "skipped": 0}
+        start = time.perf_counter()
+        progress = tqdm(desc=f"Ingest {self.collection_name}", unit="doc", disable=not show_progress)
+        while True:
+            batch = list(islice(documents, batch_size))
+            if not batch:
+                break
+            vectors, payloads = self._embed_new(batch, index_field, existing)
+            new_vectors.append(vectors)
+            new_payloads.extend(payloads)
+
+            stats["documents"] += len(batch)
+            stats["ingested"] += len(payloads)
+            stats["skipped"] += len(batch) - len(payloads)
+            progress.update(len(batch))
+        progress.close()
+
+        if new_payloads:
+            with self._lock:
+                self._save(np.concatenate([self._vectors, *new_vectors]), self._payloads + new_payloads)
+
+        stats["seconds"] = time.perf_counter() - start
+        stats["docs_per_second"] = stats["documents"] / stats["seconds"] if stats["seconds"] else 0.
+        return stats
+
+    def delete(self, node_ids: List):
+        node_ids = set(node_ids)
+        with self._lock:
+            keep = [idx for idx, payload in enumerate(self._payloads) if payload["id"] not in node_ids]
+            self._save(np.asarray(self._vectors[keep]), [self._payloads[idx] for idx in keep])
+
+    def reset(self):
+        with self._lock:
+            self._save(np.zeros((0, self.config.embedding_dim), dtype=self.dtype), [])
+
+    def get_source_filter(self, sources: List[Tuple[str, str]]) -> List[Dict]:
+        return [{"table": table, "column": column} for table, column in sources]
+
+    def _get_mask(self, filter) -> np.ndarray:
+        """
+        Rows whose metadata matches every key of `filter` (a value, or a list of allowed values).
+        A list of such dicts matches the rows satisfying any of them.
+        """
+        if isinstance(filter, list):
+            return np.logical_or.reduce([self._get_mask(condition) for condition in filter] + [np.zeros(len(self._payloads), dtype=bool)])
+
+        mask = np.ones(len(self._payloads), dtype=bool)
+        for key, values in (filter or {}).items():
+            if key not in self._metadata_columns:
+                self._metadata_columns[key] = np.array(
+                    [payload["metadata"].get(key) for payload in self._payloads], dtype=object,
+                )
+            values = values if isinstance(values, (list, tuple, set)) else [values]
+            mask &= np.isin(self._metadata_columns[key], list(values))
+        return mask
+
+    def _to_documents(self, scores: np.ndarray, top_k: int, score_threshold: float = None) -> List[Document]:
+        if len(scores) > top_k:
+            candidates = np.argpartition(-scores, top_k)[:top_k]
+        else:
+            candidates = np.arange(len(scores))
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+        documents = []
+        for idx in candidates:
+            if not np.isfinite(scores[idx]) or (score_threshold is not None and scores[idx] < score_threshold):
+                continue
+            payload = self._payloads[idx]
+            documents.append(Document(
+                page_content=payload["page_content"],
+                metadata={**payload["metadata"], "_id": payload["id"], "similarity": float(scores[idx])},
+            ))
+        return documents
+
+    def retrieve(
+        self, 
+        query: str, 
+        top_k: int = 5,
+        filter: Dict = None,
+        score_threshold: float = None,
+    ) -> List[Document]:
+        return self.retrieve_many([query], top_k, filter, score_threshold)[0]
+
+    def retrieve_many(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        filter: Dict = None,
+        score_threshold: float = None,
+        filters: List = None,
+    ) -> List[List[Document]]:
+        if not queries:
+            return []
+
+        query_vectors = self._embed(queries)
+        with self._lock:
+            scores = self._score(query_vectors)
+            if filter:
+                scores[:, ~self._get_mask(filter)] = -np.inf
+            for row, query_filter in enumerate(filters or []):
+                if query_filter:
+                    scores[row, ~self._get_mask(query_filter)] = -np.inf
+            if self._codes is not None and self.config.quantization_rescore:
+                scores = self._rescore(scores, query_vectors, top_k)
+            return [self._to_documents(row, top_k, score_threshold) for row in scores]
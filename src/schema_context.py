@@ -0,0 +1,136 @@
+import re
+import threading
+from typing import List, Dict, Iterable
+
+from sqlalchemy import text
+from langchain_community.utilities.sql_database import SQLDatabase
+
+from utils import get_db_fingerprint
+
+
+class SchemaContext:
+    """
+    Provides the schema section of the prompts.
+
+    The full `get_table_info()` rendering is cached until the database fingerprint changes.
+    In pruned mode, only the tables and columns referenced by the given SQL queries and
+    lookup matches are rendered (plus the join keys shared between those tables).
+    """
+    def __init__(self, sql_db: SQLDatabase, pruned: bool = False):
+        self.sql_db = sql_db
+        self.pruned = pruned
+
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self._table_info = None
+        self._columns = None
+        self._pruned_table_info = {}
+
+    def get_table_info(
+        self,
+        sql_queries: Iterable[str] = (),
+        entity_matches: Iterable[Dict] = (),
+    ) -> str:
+        with self._lock:
+            self._refresh()
+
+            if self.pruned:
+                selection = self._select_columns(sql_queries, entity_matches)
+                if selection:
+                    key = tuple(sorted((table, tuple(columns)) for table, columns in selection.items()))
+                    if key not in self._pruned_table_info:
+                        self._pruned_table_info[key] = self._render(selection)
+                    return self._pruned_table_info[key]
+
+            if self._table_info is None:
+                self._table_info = self.sql_db.get_table_info()
+            return self._table_info
+
+    def _refresh(self):
+        fingerprint = get_db_fingerprint(self.sql_db)
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            self._table_info = None
+            self._columns = None
+            self._pruned_table_info = {}
+
+    def _get_columns(self) -> Dict[str, List[Dict]]:
+        if self._columns is None:
+            self._columns = {
+                table: self.sql_db._inspector.get_columns(table)
+                for table in self.sql_db.get_usable_table_names()
+            }
+        return self._columns
+
+    def _select_columns(
+        self,
+        sql_queries: Iterable[str],
+        entity_matches: Iterable[Dict],
+    ) -> Dict[str, List[str]]:
+        tokens = set()
+        for sql_query in sql_queries:
+            tokens.update(token.upper() for token in re.findall(r"[A-Za-z_][A-Za-z0-9_]*", sql_query))
+
+        matched_columns = set()
+        for entity_match in entity_matches:
+            for match in entity_match["matches"]:
+                table, column = match["metadata"]["table"], match["metadata"]["column"]
+                tokens.add(table.upper())
+                matched_columns.add((table.upper(), column.upper()))
+
+        columns = self._get_columns()
+        tables = [table for table in columns if table.upper() in tokens]
+        if not tables:
+            return {}
+
+        # Columns present in several selected tables are kept as join keys
+        column_counts = {}
+        for table in tables:
+            for column in columns[table]:
+                column_counts[column["name"].upper()] = column_counts.get(column["name"].upper(), 0) + 1
+
+        selection = {}
+        for table in tables:
+            selected = [
+                column["name"] for column in columns[table]
+                if column["name"].upper() in tokens
+                or (table.upper(), column["name"].upper()) in matched_columns
+                or column_counts[column["name"].upper()] > 1
+            ]
+            selection[table] = selected or [column["name"] for column in columns[table]]
+        return selection
+
+    def _render(self, selection: Dict[str, List[str]]) -> str:
+        columns = self._get_columns()
+        quote = self.sql_db._engine.dialect.identifier_preparer.quote
+
+        tables = []
+        for table, selected in selection.items():
+            column_types = {column["name"]: column["type"] for column in columns[table]}
+            definition = ",\n".join(f"\t{quote(name)} {column_types[name]}" for name in selected)
+            table_info = f"CREATE TABLE {quote(table)} (\n{definition}\n)"
+
+            sample_rows = self._get_sample_rows(table, selected)
+            if sample_rows:
+                table_info += f"\n\n/*\n{sample_rows}\n*/"
+            tables.append(table_info)
+
+        return "\n\n".join(tables)
+
+    def _get_sample_rows(self, table: str, selected: List[str]) -> str:
+        n_rows = self.sql_db._sample_rows_in_table_info
+        if not n_rows:
+            return ""
+
+        quote = self.sql_db._engine.dialect.identifier_preparer.quote
+        command = text(
+            f"SELECT {', '.join(quote(name) for name in selected)} FROM {quote(table)} LIMIT {int(n_rows)}"
+        )
+        try:
+            with self.sql_db._engine.connect() as connection:
+                rows = connection.execute(command).fetchall()
+        except Exception:
+            return ""
+
+        rows_str = "\n".join("\t".join(str(value)[:100] for value in row) for row in rows)
+        return f"{n_rows} rows from {table} table:\n" + "\t".join(selected) + "\n" + rows_str
@@ -0,0 +1,146 @@
+import time
+import sqlite3
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+from langchain_community.utilities.sql_database import SQLDatabase, truncate_word
+
+from utils import get_sqlite_file, connect_readonly
+
+
+@dataclass
+class ExecutionResult:
+    """
+    Outcome of one query: `status` is ok, timeout, too_many_rows, error or rejected (by the
+    planner check, without running), and `response` the `sql_db.run` string of the rows
+    ("DATA FAILED" unless ok). `rows` is the number of rows fetched, None when unknown
+    (unguarded runs and cache hits).
+    """
+    status: str
+    response: str
+    rows: Optional[int] = None
+    elapsed: float = 0.
+    error: Optional[str] = None
+    cached: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "ok"
+
+    def to_dict(self) -> Dict:
+        result = asdict(self)
+        result.pop("response")
+        return result
+
+
+def format_rows(sql_db: SQLDatabase, rows: List[tuple]) -> str:
+    """
+    Same string as `sql_db.run` for the given rows.
+    """
+    rows = [tuple(truncate_word(value, length=sql_db._max_string_length) for value in row) for row in rows]
+    return str(rows) if rows else ""
+
+
+def run_unguarded(sql_db: SQLDatabase, sql: str) -> ExecutionResult:
+    """
+    `sql_db.run` without limits, with its outcome reported as an `ExecutionResult`.
+    """
+    start = time.perf_counter()
+    try:
+        response = sql_db.run(sql)
+    except Exception as e:
+        return ExecutionResult("error", "DATA FAILED", elapsed=time.perf_counter() - start, error=str(e))
+    return ExecutionResult("ok", response, elapsed=time.perf_counter() - start)
+
+
+class SQLExecutor:
+    """
+    Runs queries with a wall-clock timeout (seconds), a row cap and a cap on the size of the
+    fetched result (bytes); a limit set to None is disabled.
+    SQLite databases are read on a private read-only connection per query, aborted by a
+    progress handler once the deadline passes, so a runaway query only holds its own worker
+    for `timeout` seconds. Other backends go through the SQLAlchemy engine, where the limits
+    are checked between fetched batches.
+    """
+    def __init__(
+        self,
+        sql_db: SQLDatabase,
+        timeout: float = 30.,
+        max_rows: int = 10000,
+        memory_limit: int = 256 * 2 ** 20,
+        fetch_size: int = 1000,
+    ):
+        self.sql_db = sql_db
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.memory_limit = memory_limit
+        self.fetch_size = fetch_size
+
+        self.db_file = get_sqlite_file(sql_db)
+
+    def execute(self, sql: str) -> ExecutionResult:
+        start = time.perf_counter()
+        deadline = start + self.timeout if self.timeout is not None else None
+        try:
+            if self.db_file is not None:
+                status, rows, error = self._execute_sqlite(sql, deadline)
+            else:
+                status, rows, error = self._execute_engine(sql, deadline)
+        except Exception as e:
+            status, rows, error = "error", [], str(e)
+
+        elapsed = time.perf_counter() - start
+        if status != "ok":
+            return ExecutionResult(status, "DATA FAILED", len(rows), elapsed, error)
+        return ExecutionResult(status, format_rows(self.sql_db, rows), len(rows), elapsed)
+
+    def _execute_sqlite(self, sql: str, deadline: Optional[float]):
+        connection = connect_readonly(self.db_file)
+        try:
+            if self.memory_limit is not None:
+                # Bound the page cache of this connection (negative size is in KiB)
+                connection.execute(f"PRAGMA cache_size = -{max(self.memory_limit // 1024, 1)}")
+
+            timed_out = []
+            if deadline is not None:
+                def check_deadline():
+                    if time.perf_counter() > deadline:
+                        timed_out.append(True)
+                        return 1
+                    return 0
+                connection.set_progress_handler(check_deadline, 10000)
+
+            try:
+                cursor = connection.execute(sql)
+                return self._fetch(cursor.fetchmany, deadline)
+            except sqlite3.OperationalError as e:
+                if timed_out:
+                    return "timeout", [], f"Query exceeded {self.timeout}s"
+                raise e
+        finally:
+            connection.close()
+
+    def _execute_engine(self, sql: str, deadline: Optional[float]):
+        with self.sql_db._engine.connect() as connection:
+            cursor = connection.execution_options(stream_results=True).execute(text(sql))
+            if not cursor.returns_rows:
+                return "ok", [], None
+            return self._fetch(cursor.fetchmany, deadline)
+
+    def _fetch(self, fetchmany, deadline: Optional[float]):
+        rows, size = [], 0
+        while True:
+            batch = fetchmany(self.fetch_size)
+            if not batch:
+                return "ok", rows, None
+            rows.extend(tuple(row) for row in batch)
+
+            if self.max_rows is not None and len(rows) > self.max_rows:
+                return "too_many_rows", rows[:self.max_rows], f"Result exceeds {self.max_rows} rows"
+            if self.memory_limit is not None:
+                size += sum(len(repr(row)) for row in batch)
+                if size > self.memory_limit:
+                    return "too_many_rows", rows, f"Result exceeds {self.memory_limit} bytes"
+            if deadline is not None and time.perf_counter() > deadline:
+                return "timeout", rows, f"Query exceeded {self.timeout}s"
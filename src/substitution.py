@@ -0,0 +1,174 @@
+import re
+from typing import List, Dict, Tuple, Optional, Iterator
+
+from utils import lookup_key
+
+
+LITERAL_PATTERN = re.compile(r"(\"|')((?:(?!\1).)*)\1", flags=re.DOTALL)
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+NAME_POSITION_PATTERN = re.compile(r"\b(?:FROM|JOIN)\s*$", flags=re.IGNORECASE)
+# Operator right before a literal that is compared against a column value
+COMPARISON = r"(?:=|==|!=|<>|\bLIKE\b|\bIN\s*\()\s*$"
+
+
+def quote_literal(value: str, quote: str) -> str:
+    return quote + value.replace(quote, quote * 2) + quote
+
+
+def is_quoted_identifier(sql: str, quoted: re.Match) -> bool:
+    """
+    Whether a double-quoted span is a name rather than a string: qualified
+    (`TABLE."COL"`, `"TABLE".COL`) or in FROM/JOIN position.
+    """
+    if quoted.group(1) != '"':
+        return False
+    return (
+        sql[:quoted.start()].endswith(".")
+        or sql[quoted.end():].startswith(".")
+        or NAME_POSITION_PATTERN.search(sql[:quoted.start()]) is not None
+    )
+
+
+def iter_literals(sql: str) -> Iterator[re.Match]:
+    """
+    String literals of a SQL query; quoted identifiers are skipped.
+    """
+    return (quoted for quoted in LITERAL_PATTERN.finditer(sql) if not is_quoted_identifier(sql, quoted))
+
+
+def get_identifiers(sql: str) -> set:
+    """
+    Upper-cased identifiers of a SQL query (quoted ones included), string literals excluded.
+    """
+    parts = []
+    last = 0
+    for literal in iter_literals(sql):
+        parts.append(sql[last:literal.start()])
+        last = literal.end()
+    parts.append(sql[last:])
+    return {token.upper() for token in IDENTIFIER_PATTERN.findall(" ".join(parts))}
+
+
+def canonicalize_sql(sql: str) -> str:
+    """
+    Cache key form of a query: lower-cased, whitespace collapsed and no trailing semicolon,
+    with string literals kept verbatim.
+    """
+    parts = []
+    last = 0
+    for literal in iter_literals(sql):
+        parts.append(re.sub(r"\s+", " ", sql[last:literal.start()].lower()))
+        parts.append(literal.group(0))
+        last = literal.end()
+    parts.append(re.sub(r"\s+", " ", sql[last:].lower()))
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def find_literals(sql: str, values: List[str], column: str = None) -> List[re.Match]:
+    """
+    String literals of `sql` equal to any of `values` after normalization.
+    With `column`, only literals compared against that column are returned.
+    """
+    keys = {lookup_key(value) for value in values}
+    literals = []
+
+    for literal in iter_literals(sql):
+        if lookup_key(literal.group(2)) not in keys:
+            continue
+        if column is not None and not re.search(
+            rf"\b{re.escape(column)}[\"`\]]?\s*{COMPARISON}",
+            sql[:literal.start()],
+            flags=re.IGNORECASE,
+        ):
+            continue
+        literals.append(literal)
+
+    return literals
+
+
+def get_compared_values(sql: str) -> List[str]:
+    """
+    Values of the string literals compared against a column, i.e. what lookups search for
+    (LIKE wildcards at the ends stripped).
+    """
+    return [
+        literal.group(2).strip("%") for literal in iter_literals(sql)
+        if re.search(COMPARISON, sql[:literal.start()], flags=re.IGNORECASE)
+    ]
+
+
+def replace_literals(sql: str, literals: List[re.Match], value: str) -> str:
+    for literal in sorted(literals, key=lambda x: x.start(), reverse=True):
+        sql = sql[:literal.start()] + quote_literal(value, literal.group(1)) + sql[literal.end():]
+    return sql
+
+
+def swap_values(sql: str, replacements: List[Tuple[str, str]]) -> Optional[str]:
+    """
+    Replace the literal of every (old value, new value) pair in one pass.
+    Returns None if an old value has no literal in `sql`.
+    """
+    edits = {}
+    for old_value, new_value in replacements:
+        literals = find_literals(sql, [old_value])
+        if not literals or any(literal.start() in edits for literal in literals):
+            return None
+        edits.update({literal.start(): (literal, new_value) for literal in literals})
+
+    for literal, new_value in sorted(edits.values(), key=lambda x: x[0].start(), reverse=True):
+        sql = sql[:literal.start()] + quote_literal(new_value, literal.group(1)) + sql[literal.end():]
+    return sql
+
+
+def resolve_match(sql_template: str, entity_match: Dict, threshold: int = 0) -> Optional[Dict]:
+    """
+    The single lookup match that can be substituted without the LLM: within `threshold`
+    edit distance, no worse than any other match, and pointing at a table and column the
+    template already uses. Returns None when no such match exists or the choice is ambiguous.
+    """
+    matches = entity_match["matches"]
+    if not matches:
+        return None
+
+    identifiers = get_identifiers(sql_template)
+    best_score = min(match["score"] for match in matches)
+    candidates = {
+        (match["page_content"], match["metadata"]["table"], match["metadata"]["column"]): match
+        for match in matches
+        if match["score"] <= threshold
+        and match["score"] == best_score
+        and match["metadata"]["table"].upper() in identifiers
+        and match["metadata"]["column"].upper() in identifiers
+    }
+    return next(iter(candidates.values())) if len(candidates) == 1 else None
+
+
+def substitute_sources(
+    sql_template: str,
+    relevant_entity_match: List[Dict],
+    threshold: int = 0,
+) -> Tuple[str, List[Dict]]:
+    """
+    Rewrite the template for every entity with an unambiguous lookup match.
+    Returns the rewritten template and the entity matches left for the LLM.
+    """
+    unresolved = []
+
+    for entity_match in relevant_entity_match:
+        if not entity_match["matches"]:
+            continue
+
+        match = resolve_match(sql_template, entity_match, threshold)
+        literals = find_literals(
+            sql_template,
+            [entity_match["entity"], match["page_content"]],
+            column=match["metadata"]["column"],
+        ) if match else []
+
+        if literals:
+            sql_template = replace_literals(sql_template, literals, match["page_content"])
+            entity_match["resolved_by"] = "rule"
+        else:
+            unresolved.append(entity_match)
+
+    return sql_template, unresolved
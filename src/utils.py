@@ -1,17 +1,71 @@
+import os
 import re
 import sqlite3
 import random
+from typing import Optional
 
 
 def tokenize(text: str):
     return re.findall(r'\b\w+\b', text.lower())
 
 
+def lookup_key(text: str) -> str:
+    """
+    Token-sorted, lower-cased form of a value, used to compare entities with lookup values.
+    """
+    return " ".join(sorted(tokenize(text)))
+
+
 def remove_sql_wrapper(text):
     pattern = r"```sql\s*(.*?)\s*```"
     return re.sub(pattern, r"\1", text, flags=re.DOTALL | re.IGNORECASE)
 
 
+def get_sqlite_file(sql_db) -> Optional[str]:
+    """
+    Path of the SQLite file behind a SQLDatabase; None for other backends and in-memory databases.
+    """
+    url = sql_db._engine.url
+    if url.get_backend_name() == "sqlite" and url.database and url.database != ":memory:":
+        return url.database
+    return None
+
+
+def connect_readonly(db_file: str) -> sqlite3.Connection:
+    """
+    Read-only connection to a SQLite file, usable from any thread.
+    """
+    return sqlite3.connect(f"file:{db_file}?mode=ro", uri=True, check_same_thread=False)
+
+
+def get_data_version(sql_db) -> Optional[tuple]:
+    """
+    Cheap version stamp of the data of a SQLite file database: size and mtime of the file
+    (and its WAL). None for other backends, whose data changes cannot be seen this way;
+    result caches must not keep rows for them.
+    """
+    db_file = get_sqlite_file(sql_db)
+    if db_file is not None:
+        stamps = []
+        for path in [db_file, db_file + "-wal"]:
+            if os.path.exists(path):
+                stat = os.stat(path)
+                stamps.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(stamps)
+    return None
+
+
+def get_db_fingerprint(sql_db) -> tuple:
+    """
+    Version stamp of a database schema: the data version of SQLite files, or the list of
+    usable tables for other backends.
+    """
+    data_version = get_data_version(sql_db)
+    if data_version is not None:
+        return data_version
+    return tuple(sorted(sql_db.get_usable_table_names()))
+
+
 def drop_cases(cases, top_k=5, p_top=1.0):
     def drop_prob(rank):
         if rank > top_k: